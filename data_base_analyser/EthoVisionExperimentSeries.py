@@ -3,6 +3,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 from fish_data_base.EthoVisionSQLdataBase import EthoVisionSQLdataBase
+from fish_data_base.EthoVisionParquetDataBase import EthoVisionParquetDataBase
 from trace_analysis.EthoVisionDataProcessor import EthovisionDataProcessor
 from plotting.IndividualAnalysisReportEthoVision import IndividualAnalysisReportEthoVision
 from tqdm import tqdm
@@ -16,20 +17,34 @@ class EthoVisionExperimentSeries:
         tag (str): The tag for the experiment series.
         parent_directory (str): The directory containing the experiment data.
         db_name (str): The name of the SQLite database file.
-        ev_db (EthoVisionSQLdataBase): An instance of the EthoVision SQL database.
+        ev_db (EthoVisionSQLdataBase): An instance of the EthoVision SQL database (or of
+            EthoVisionParquetDataBase). None if the series is analysed straight from the
+            EthoVision readers.
     """
-    def __init__(self, tag, parent_directory):
+    def __init__(self, tag, parent_directory, use_database = True, backend = 'sqlite'):
         """
         Initializes the EthoVisionExperimentSeries class with a tag and parent directory.
         
         Args:
             tag (str): The tag for the experiment series.
             parent_directory (str): The directory containing the experiment data.
+            use_database (bool, optional): If False, no database is opened and the data
+                is passed to process_and_save as EthoVision readers. Defaults to True.
+            backend (str, optional): 'sqlite' for the <tag>_ethovision_data.db database or
+                'parquet' for the <tag>_ethovision_data.parquet dataset, see
+                EthoVisionParquetDataBase. Defaults to 'sqlite'.
         """
         self.tag = tag
         self.parent_directory = parent_directory
-        self.db_name = os.path.join(self.parent_directory, f"{self.tag}_ethovision_data.db")
-        self.ev_db = EthoVisionSQLdataBase(self.db_name)
+        if backend == 'sqlite':
+            self.db_name = os.path.join(self.parent_directory, f"{self.tag}_ethovision_data.db")
+            database_class = EthoVisionSQLdataBase
+        elif backend == 'parquet':
+            self.db_name = os.path.join(self.parent_directory, f"{self.tag}_ethovision_data.parquet")
+            database_class = EthoVisionParquetDataBase
+        else:
+            raise ValueError(f"backend must be 'sqlite' or 'parquet', not {backend!r}")
+        self.ev_db = database_class(self.db_name) if use_database else None
 
     def save_numpy_array(self, n_array, filename):
         """
@@ -93,52 +108,118 @@ class EthoVisionExperimentSeries:
         for i in range(len(fig_handles)):
             self.save_figure(fig_handles[i], os.path.join(subject_dir_str, f'{names[i]}.svg'))
 
-    def process_and_save(self):
+    def iter_subjects_from_database(self):
         """
-        Processes and saves the data and figures for the EthoVision experiment series.
+        Yields the data of every subject stored in the database, read in one ordered
+        pass by EthoVisionSQLdataBase.iter_subjects.
+
+        Yields:
+            tuple: The tank number, the fish ID and the DataFrame of the subject.
         """
-        if self.ev_db.db_connection:
-            # Get the unique combinations of 'Tank_number', 'Sex', and 'Subject ID' values
-            unique_fish = self.ev_db.get_unique_subjects()
-            result_list = list()
-            with tqdm(total=unique_fish.shape[0], desc='individual analysis') as pbar:
-                for i, row in unique_fish.iterrows():
-                    pbar.set_description(f"Tank: {row.Tank_number}, ID: {row.ID}")
-                    
-                    # Get subject data
-                    subject_df = self.ev_db.get_data_for_subject(row.Tank_number, row.ID)
-
-                    # process data
-                    evp = EthovisionDataProcessor(subject_df)
-                    result_df, histograms = evp.process_data(tank_height=20.5, tank_width=20.5)
-                    subject_df = evp.subject_df
-
-                    # produce figures
-                    reporter = IndividualAnalysisReportEthoVision(result_df, histograms)
-                    rep_figs = reporter.report()
-
-                    # save output
-                    subject_directory = self.make_subject_directory_string(row.Tank_number, row.ID)
-                    self.save_report_figures(rep_figs, subject_directory)
-                    self.save_numpy_array(histograms, os.path.join(subject_directory, 'spatial_histograms.npy'))
-                    self.save_dataframe(result_df, os.path.join(subject_directory, 'collated_data.csv'))
-                    self.save_dataframe(subject_df, os.path.join(subject_directory, 'trajectory_data.csv'))
-                    result_list.append(result_df)
-
-                    # Close all figures
-                    plt.close('all')
-                    
-                    pbar.update(1)            
-                
-
-
-            
-            #Save out results
-            result_list = pd.concat(result_list)
-            self.save_dataframe(result_list, os.path.join(self.parent_directory, f'{self.tag}_daywise_analysis.csv'))
-            
-            # Close the SQLite database connection
-            self.ev_db.close_connection()
+        yield from self.ev_db.iter_subjects()
+
+    def iter_subjects_from_readers(self, etho_vision_readers, grouped_by_subject = False):
+        """
+        Yields the data of every subject found in the given EthoVision readers, without
+        writing it to a database first.
+
+        The trajectories are grouped by (Tank_number, ID) as they are parsed, and every
+        subject is sorted by start time and recording time like
+        EthoVisionSQLdataBase.get_data_for_subject does. A subject is only complete once
+        all files are read, so by default the whole input is held in memory before the
+        first subject is yielded. For large series, pass the readers grouped by subject
+        (e.g. one group per batch of fish) and set grouped_by_subject: the subjects of a
+        group are yielded as soon as the group ends, so only one group is held in memory.
+
+        Args:
+            etho_vision_readers (iterable): EthoVision readers, ideally in streaming mode, or
+                iterables of readers if grouped_by_subject is set.
+            grouped_by_subject (bool, optional): If True, etho_vision_readers yields groups
+                of readers and no subject may appear in more than one group. Defaults to False.
+
+        Yields:
+            tuple: The tank number, the fish ID and the DataFrame of the subject.
+        """
+        reader_groups = etho_vision_readers if grouped_by_subject else [etho_vision_readers]
+        for reader_group in reader_groups:
+            subject_trajectories = dict()
+            for etho_vision_reader in reader_group:
+                for df_trajectory in etho_vision_reader.iter_trajectories():
+                    if df_trajectory is None or df_trajectory.empty:
+                        continue
+                    subject = (df_trajectory.Tank_number.iloc[0], df_trajectory.ID.iloc[0])
+                    subject_trajectories.setdefault(subject, list()).append(df_trajectory)
+
+            for (tank_number, fish_id), trajectories in subject_trajectories.items():
+                subject_df = pd.concat(trajectories, ignore_index=True)
+                subject_df = subject_df.sort_values(by=['Start_time_epoch', 'Recording_time_s'], kind='stable', ignore_index=True)
+                yield tank_number, fish_id, subject_df
+
+    def process_subject(self, tank_number, fish_id, subject_df):
+        """
+        Processes the data of one subject and saves its figures, histograms and tables.
+
+        Args:
+            tank_number (int): The tank number.
+            fish_id (str): The fish ID.
+            subject_df (pandas.DataFrame): The trajectory data of the subject.
 
+        Returns:
+            pandas.DataFrame: The daywise results of the subject.
+        """
+        # process data
+        evp = EthovisionDataProcessor(subject_df)
+        result_df, histograms = evp.process_data(tank_height=20.5, tank_width=20.5)
+        subject_df = evp.subject_df
+
+        # produce figures
+        reporter = IndividualAnalysisReportEthoVision(result_df, histograms)
+        rep_figs = reporter.report()
+
+        # save output
+        subject_directory = self.make_subject_directory_string(tank_number, fish_id)
+        self.save_report_figures(rep_figs, subject_directory)
+        self.save_numpy_array(histograms, os.path.join(subject_directory, 'spatial_histograms.npy'))
+        self.save_dataframe(result_df, os.path.join(subject_directory, 'collated_data.csv'))
+        self.save_dataframe(subject_df, os.path.join(subject_directory, 'trajectory_data.csv'))
+
+        # Close all figures
+        plt.close('all')
+
+        return result_df
+
+    def process_and_save(self, etho_vision_readers = None, grouped_by_subject = False):
+        """
+        Processes and saves the data and figures for the EthoVision experiment series.
+
+        Args:
+            etho_vision_readers (list, optional): EthoVision readers to analyse directly,
+                skipping the database. If None, the subjects are read from the database.
+                Defaults to None.
+            grouped_by_subject (bool, optional): If True, etho_vision_readers yields groups of
+                readers, see iter_subjects_from_readers. Defaults to False.
+        """
+        if etho_vision_readers is not None:
+            subjects = self.iter_subjects_from_readers(etho_vision_readers, grouped_by_subject)
+            num_subjects = None
+        elif self.ev_db is not None and self.ev_db.is_open():
+            subjects = self.iter_subjects_from_database()
+            num_subjects = self.ev_db.get_unique_subjects().shape[0]
         else:
             print("Could not open the database")
+            return
+
+        result_list = list()
+        with tqdm(total=num_subjects, desc='individual analysis') as pbar:
+            for tank_number, fish_id, subject_df in subjects:
+                pbar.set_description(f"Tank: {tank_number}, ID: {fish_id}")
+                result_list.append(self.process_subject(tank_number, fish_id, subject_df))
+                pbar.update(1)
+
+        #Save out results
+        result_list = pd.concat(result_list)
+        self.save_dataframe(result_list, os.path.join(self.parent_directory, f'{self.tag}_daywise_analysis.csv'))
+
+        # Close the SQLite database connection
+        if self.ev_db is not None:
+            self.ev_db.close_connection()
@@ -0,0 +1,158 @@
+import pandas as pd
+import pyarrow as pa
+from data_handlers.EthoVisionReader import EthoVisionReader
+
+
+def convert_to_arrow(etho_vision_reader, arrow_filename):
+    """
+    Converts the file of an EthoVision reader into an Arrow IPC (Feather v2) archive.
+
+    Every track with samples is stored as one record batch, holding the columns that
+    EthoVisionReader.main() returns. The samples are stored as parsed, before the
+    correction factor and the tank transform are applied, so the archive stays valid
+    when the correction factor or the tank calibration changes. The file is written
+    uncompressed so it can be memory-mapped.
+
+    Args:
+        etho_vision_reader (EthoVisionReader): The reader of the workbook or text export.
+        arrow_filename (str): The filename of the archive to write.
+
+    Returns:
+        int: The number of tracks written to the archive.
+    """
+    meta_columns = etho_vision_reader.get_meta_columns()
+    writer = None
+    num_tracks = 0
+
+    try:
+        for sheet_name, sheet_data in etho_vision_reader.iter_sheets():
+            df_raw = etho_vision_reader.get_raw_trajectory(sheet_data)
+            if df_raw is None:
+                continue
+
+            # Metadata as nullable strings, so all batches share one schema
+            for column in meta_columns:
+                df_raw[column] = df_raw[column].astype('string')
+            df_raw = df_raw.astype({column: 'float64' for column in df_raw.columns if column not in meta_columns})
+
+            if writer is None:
+                schema = pa.Schema.from_pandas(df_raw, preserve_index=False)
+                writer = pa.ipc.new_file(arrow_filename, schema)
+            writer.write_batch(pa.RecordBatch.from_pandas(df_raw, schema=schema, preserve_index=False))
+            num_tracks += 1
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return num_tracks
+
+
+class EthoVisionArrowReader(EthoVisionReader):
+    """
+    A class to read the Arrow archives written by convert_to_arrow.
+
+    The archive is memory-mapped and read one record batch (track) at a time. The
+    correction factor and the tank transform of this reader are applied on reading,
+    so main() returns the same frame as EthoVisionReader.main() on the original file
+    with the same settings, without parsing Excel again.
+
+    Attributes:
+        filename (str): The filename of the Arrow archive to read.
+        excel_data (dict): A dictionary mapping the batch index to the raw track data.
+                           None in streaming mode.
+    """
+
+    def read_file(self):
+        """
+        Reads all tracks of the Arrow archive into a dictionary.
+
+        Returns:
+            dict: A dictionary mapping the batch index to a DataFrame with the raw track data.
+        """
+        return dict(self.iter_batches())
+
+    def iter_batches(self):
+        """
+        Yields the tracks of the memory-mapped Arrow archive one at a time.
+
+        Yields:
+            tuple: The batch index and a DataFrame with the raw track data.
+        """
+        with pa.memory_map(self.filename, 'r') as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield i, reader.get_batch(i).to_pandas()
+
+    def iter_sheets(self):
+        """
+        Yields the tracks of the Arrow archive.
+
+        Yields:
+            tuple: The batch index and a DataFrame with the raw track data.
+        """
+        if self.excel_data is not None:
+            yield from self.excel_data.items()
+        else:
+            yield from self.iter_batches()
+
+    def get_sheet_names(self):
+        """
+        Returns the batch indices of the tracks of the Arrow archive.
+
+        Returns:
+            list: The batch indices.
+        """
+        if self.excel_data is not None:
+            return list(self.excel_data)
+        with pa.memory_map(self.filename, 'r') as source:
+            return list(range(pa.ipc.open_file(source).num_record_batches))
+
+    def read_sheet(self, sheet_name, engine = None):
+        """
+        Reads one track of the memory-mapped Arrow archive.
+
+        Args:
+            sheet_name (int): The batch index returned by get_sheet_names.
+            engine (str, optional): Ignored, archives are not read with an Excel engine.
+
+        Returns:
+            DataFrame: The raw track data.
+        """
+        if self.excel_data is not None:
+            return self.excel_data.get(sheet_name)
+        with pa.memory_map(self.filename, 'r') as source:
+            return pa.ipc.open_file(source).get_batch(sheet_name).to_pandas()
+
+    def get_raw_trajectory(self, df_raw):
+        """
+        Returns the raw trajectory data with metadata of an archived track.
+
+        Args:
+            df_raw (DataFrame): The raw track data as stored in the archive.
+
+        Returns:
+            DataFrame: The raw trajectory data with metadata.
+        """
+        return df_raw.copy()
+
+    def process_sheet(self, df_raw):
+        """
+        Processes an archived track into a trajectory DataFrame with metadata, in the
+        same steps as EthoVisionReader.process_sheet.
+
+        Args:
+            df_raw (DataFrame): The raw track data as stored in the archive.
+
+        Returns:
+            DataFrame: The processed trajectory data.
+        """
+        meta_columns = self.get_meta_columns()
+        meta_data = {key: df_raw[key.replace(' ', '_')].iloc[0] for key in self.meta_keys}
+        meta_data = {key: None if pd.isna(value) else value for key, value in meta_data.items()}
+
+        return self.process_trajectory(df_raw.drop(columns=meta_columns, errors='ignore'), meta_data)
+
+# Example usage:
+# etho_vision_reader = EthoVisionReader("/home/bgeurten/Downloads/Raw_data-2023_setup-Trial1.xlsx", streaming_mode=True)
+# convert_to_arrow(etho_vision_reader, "/home/bgeurten/Downloads/Raw_data-2023_setup-Trial1.feather")
+# final_data = EthoVisionArrowReader("/home/bgeurten/Downloads/Raw_data-2023_setup-Trial1.feather", correction_mode=True).main()
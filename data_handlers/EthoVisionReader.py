@@ -1,7 +1,36 @@
+import time
 import pandas as pd
 import numpy as np
-from scipy.interpolate import griddata
 import matplotlib.pyplot as plt
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from openpyxl import load_workbook
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+def read_and_process_sheet(etho_vision_reader, sheet_name, engine = None):
+    """
+    Reads and processes one sheet in a worker process of
+    EthoVisionReader.process_sheets_in_parallel.
+
+    Args:
+        etho_vision_reader (EthoVisionReader): A copy of the reader, sent to the worker.
+        sheet_name: The sheet to read, see EthoVisionReader.get_sheet_names.
+        engine (str, optional): The Excel engine to read with. Defaults to None.
+
+    Returns:
+        tuple: The processed trajectory (None for empty tracks) and the tracking quality
+               summaries it added.
+    """
+    etho_vision_reader.tracking_quality = list()
+    sheet_data = etho_vision_reader.read_sheet(sheet_name, engine)
+    if sheet_data is None:
+        return None, []
+    return etho_vision_reader.process_sheet(sheet_data), etho_vision_reader.tracking_quality
+
 
 class EthoVisionReader:
     """
@@ -10,13 +39,25 @@ class EthoVisionReader:
     Attributes:
         filename (str): The filename of the Excel file to read.
         excel_data (dict): A dictionary containing the data from the Excel file.
+                           None in streaming mode, where sheets are read one at a time.
+        streaming_mode (bool): If True, sheets are read lazily with a read-only
+                               openpyxl iterator instead of loading the whole workbook.
+        num_workers (int): The number of processes reading and processing sheets in parallel.
+        excel_engine (str): The engine the sheets are read with: 'openpyxl', 'calamine' or
+                            'auto' for the fastest one installed, see select_excel_engine.
+                            None for pd.read_excel (or openpyxl in streaming mode).
+        tracking_quality (list): The tracking quality summary of every processed track.
+        tank_calibration (EthoVisionTankCalibration): Per-session tank corners, None to use
+                                                      the hard-coded corners only.
 
     Author: B. Geurten
     Date: 28th April 2023
     """
 
+    # The engine picked by the benchmark of select_excel_engine, shared by all readers of the process
+    selected_excel_engine = None
 
-    def __init__(self, filename, tank_height = 20.5, tank_width = 20.5, correction_mode = False, correction_factor = 1/38.9683801):
+    def __init__(self, filename, tank_height = 20.5, tank_width = 20.5, correction_mode = False, correction_factor = 1/38.9683801, streaming_mode = False, num_workers = 1, tank_calibration = None, excel_engine = None):
         """
         Constructs the EthoVisionReader object with the given filename.
 
@@ -24,19 +65,49 @@ class EthoVisionReader:
             filename (str): The filename of the Excel file to read.
             tank_width (float): The width of the tank.
             tank_height (float): The height of the tank.
+            streaming_mode (bool, optional): If True, the workbook is not loaded on
+                                             construction and sheets are parsed one at
+                                             a time by iter_trajectories. Defaults to False.
+            num_workers (int, optional): The number of worker processes that each read and
+                                         process whole sheets, see process_sheets_in_parallel.
+                                         The file is then not loaded on construction.
+                                         Defaults to 1 (sequential).
+            tank_calibration (EthoVisionTankCalibration, optional): Per-session tank corners
+                                         estimated from the data. Sessions it does not cover
+                                         use the hard-coded corners. Defaults to None.
+            excel_engine (str, optional): 'openpyxl' (read-only), 'calamine' (needs the
+                                         python-calamine package) or 'auto' to benchmark the
+                                         installed engines once per process and use the fastest.
+                                         All engines give identical frames. None keeps
+                                         pd.read_excel. Defaults to None.
         """
         self.filename = filename
-        self.excel_data = self.read_file()
+        self.streaming_mode = streaming_mode
+        self.num_workers = num_workers
+        self.excel_engine = excel_engine
+        self.excel_engines = {'openpyxl': self.iter_openpyxl_rows, 'calamine': self.iter_calamine_rows}
+        self.tracking_quality = list()
         self.accepted_column_heads = ['Trial time', 'Recording time', 'X center', 'Y center', 
                                       'Area', 'Areachange', 'Elongation', 'Distance moved', 
                                       'Velocity']
+        self.meta_keys = ['Tank_number', 'Sex', 'ID', 'Start time', 'Arena ID', 'Trial ID', 'Subject ID']
+        self.corrected_column_names = ['X_center_cm', 'Y_center_cm', 'Area_cm²', 'Areachange_cm²', 'Distance_moved_cm']
+        self.measure_dtype = 'float32'
+        self.meta_data_schema = {'Tank_number': 'Int64', 'Sex': 'category', 'ID': 'category',
+                                 'Start_time': 'category', 'Arena_ID': 'Int64', 'Trial_ID': 'category',
+                                 'Subject_ID': 'category', 'Start_time_epoch': 'Int64'}
+        self.start_time_format = '%m/%d/%Y %H:%M:%S.%f'
         self.correction_mode = correction_mode
         self.correction_factor = correction_factor
 
         self.tank_height = tank_height
         self.tank_width = tank_width
+        self.tank_calibration = tank_calibration
         self.set_tank_corner_coordinates()
 
+        # The workers of process_sheets_in_parallel read their sheets themselves
+        self.excel_data = None if streaming_mode or num_workers > 1 else self.read_file()
+
     def set_tank_corner_coordinates(self):
         """
         Sets the corner coordinates for each tank to be used for converting
@@ -68,6 +139,114 @@ class EthoVisionReader:
         tank_3 = {'lower left':(22.02,-22.02),'upper left':(22.02,-6.14),'upper right':(44.11,-6.28),'lower right':(43.83,-22.98)}
         self.tank_coordinates = [tank_0,tank_1,tank_2,tank_3]
 
+        # Transforms are derived from the corners, so they are recomputed on demand
+        self.tank_transforms = dict()
+
+    def get_tank_corners(self, arena_ID, session_key = None):
+        """
+        Returns the EthoVision corners of the given arena and the corresponding
+        corners of the tank coordinate system. The corners of the tank calibration
+        are used if it covers the session, the hard-coded corners otherwise.
+
+        Args:
+            arena_ID (int): The arena number.
+            session_key (str, optional): The session key of the tank calibration. Defaults to None.
+
+        Returns:
+            tuple: Two 4x2 numpy arrays with the source and target corners, ordered
+                   lower left, upper left, upper right, lower right.
+        """
+        corners = None
+        if self.tank_calibration is not None and session_key is not None:
+            corners = self.tank_calibration.get_tank_coordinates(session_key, arena_ID)
+        if corners is None:
+            corners = self.tank_coordinates[arena_ID]
+        source_points = np.array([corners['lower left'], corners['upper left'], corners['upper right'], corners['lower right']], dtype=float)
+        new_corners = np.array([(0, 0), (0, self.tank_height), ( self.tank_width,  self.tank_height), ( self.tank_width, 0)], dtype=float)
+        return source_points, new_corners
+
+    def compute_homography(self, source_points, target_points):
+        """
+        Computes the projective transform (homography) that maps the four source
+        points onto the four target points.
+
+        Args:
+            source_points (numpy.ndarray): A 4x2 array of source coordinates.
+            target_points (numpy.ndarray): A 4x2 array of target coordinates.
+
+        Returns:
+            numpy.ndarray: The 3x3 homography matrix.
+        """
+        equations = np.zeros((8, 8))
+        results = np.zeros(8)
+        for i, ((x, y), (u, v)) in enumerate(zip(source_points, target_points)):
+            equations[2*i]   = [x, y, 1, 0, 0, 0, -u*x, -u*y]
+            equations[2*i+1] = [0, 0, 0, x, y, 1, -v*x, -v*y]
+            results[2*i]     = u
+            results[2*i+1]   = v
+
+        h = np.linalg.solve(equations, results)
+        return np.append(h, 1.0).reshape(3, 3)
+
+    def get_tank_transform(self, arena_ID, session_key = None):
+        """
+        Returns the homography from EthoVision to tank coordinates for the given
+        arena. The transform is computed once per arena and session and cached in
+        `self.tank_transforms`.
+
+        Args:
+            arena_ID (int): The arena number.
+            session_key (str, optional): The session key of the tank calibration. Defaults to None.
+
+        Returns:
+            numpy.ndarray: The 3x3 homography matrix.
+        """
+        if (session_key, arena_ID) not in self.tank_transforms:
+            source_points, new_corners = self.get_tank_corners(arena_ID, session_key)
+            self.tank_transforms[(session_key, arena_ID)] = self.compute_homography(source_points, new_corners)
+        return self.tank_transforms[(session_key, arena_ID)]
+
+    def get_session_key(self, meta_data):
+        """
+        Returns the tank calibration session of a track.
+
+        Args:
+            meta_data (pd.DataFrame): A DataFrame containing the metadata.
+
+        Returns:
+            str: The session key, or None without a tank calibration.
+        """
+        if self.tank_calibration is None:
+            return None
+        return self.tank_calibration.get_session_key(meta_data['Start_time_epoch'].iloc[0])
+
+    def apply_tank_transform(self, transform, points):
+        """
+        Applies a homography to an array of points in one vectorized operation.
+
+        Points that fall outside the tank are set to NaN, as they were with the
+        previous griddata interpolation. A projective transform maps the inside of
+        the corner quadrilateral onto the inside of the tank rectangle, so the
+        bounds check can be done in tank coordinates.
+
+        Args:
+            transform (numpy.ndarray): The 3x3 homography matrix.
+            points (numpy.ndarray): An Nx2 array of EthoVision coordinates.
+
+        Returns:
+            numpy.ndarray: An Nx2 array of tank coordinates.
+        """
+        points = np.asarray(points, dtype=float)
+        projected = points @ transform[:, :2].T + transform[:, 2]
+        transformed_points = projected[:, :2] / projected[:, 2:]
+
+        tolerance = 1e-9 * max(self.tank_width, self.tank_height)
+        outside = ((transformed_points[:, 0] < -tolerance) | (transformed_points[:, 0] > self.tank_width + tolerance) |
+                   (transformed_points[:, 1] < -tolerance) | (transformed_points[:, 1] > self.tank_height + tolerance))
+        transformed_points[outside] = np.nan
+
+        return transformed_points
+
     def read_file(self):
         """
         Reads the Excel file and stores the data in a dictionary.
@@ -75,77 +254,353 @@ class EthoVisionReader:
         Returns:
             dict: A dictionary containing the data from the Excel file.
         """
-        return pd.read_excel(self.filename, sheet_name=None)
+        if self.excel_engine is None:
+            return pd.read_excel(self.filename, sheet_name=None)
+        return dict(self.iter_engine_sheets(self.get_excel_engine()))
+
+    def iter_sheets(self):
+        """
+        Yields the sheets of the Excel file one at a time.
+
+        In streaming mode the workbook is read sheet by sheet with the Excel engine
+        (openpyxl read-only by default), so only the sheet currently being processed
+        is held in memory. The yielded DataFrames are laid out like the ones returned
+        by pd.read_excel, see rows_to_sheet_data. Otherwise the sheets loaded on
+        construction are yielded.
+
+        Yields:
+            tuple: The sheet name and a DataFrame with the data of that sheet.
+        """
+        if self.excel_data is not None:
+            yield from self.excel_data.items()
+            return
+
+        yield from self.iter_engine_sheets(self.get_excel_engine() or 'openpyxl')
+
+    def get_sheet_names(self):
+        """
+        Returns the names of the sheets of the Excel file, without reading their cells.
+
+        Returns:
+            list: The sheet names, in workbook order.
+        """
+        if self.excel_data is not None:
+            return list(self.excel_data)
+        if (self.get_excel_engine() or 'openpyxl') == 'calamine':
+            return CalamineWorkbook.from_path(self.filename).sheet_names
+        workbook = load_workbook(self.filename, read_only=True)
+        sheet_names = workbook.sheetnames
+        workbook.close()
+        return sheet_names
+
+    def read_sheet(self, sheet_name, engine = None):
+        """
+        Reads a single sheet of the Excel file.
+
+        Args:
+            sheet_name (str): The name of the sheet, see get_sheet_names.
+            engine (str, optional): The Excel engine to read with. Defaults to None (the engine of this reader).
+
+        Returns:
+            DataFrame: The sheet data laid out like in iter_sheets, or None if the sheet is empty.
+        """
+        if self.excel_data is not None:
+            return self.excel_data.get(sheet_name)
+        for name, sheet_data in self.iter_engine_sheets(engine or self.get_excel_engine() or 'openpyxl', [sheet_name]):
+            return sheet_data
+        return None
+
+    def get_available_excel_engines(self):
+        """
+        Returns the Excel engines that can be used on this machine.
+
+        Returns:
+            list: The names of the installed engines.
+        """
+        return [engine for engine in self.excel_engines if engine != 'calamine' or CalamineWorkbook is not None]
+
+    def get_excel_engine(self):
+        """
+        Returns the Excel engine of this reader, running the engine benchmark for 'auto'.
+
+        Returns:
+            str: The name of the engine, or None for pd.read_excel.
+        """
+        if self.excel_engine != 'auto':
+            if self.excel_engine is not None and self.excel_engine not in self.get_available_excel_engines():
+                raise ValueError(f"Excel engine {self.excel_engine!r} is not available, use one of {self.get_available_excel_engines()}")
+            return self.excel_engine
+        if EthoVisionReader.selected_excel_engine is None:
+            EthoVisionReader.selected_excel_engine = self.select_excel_engine()
+        return EthoVisionReader.selected_excel_engine
+
+    def select_excel_engine(self):
+        """
+        Benchmarks the installed Excel engines on the first sheet of this reader's
+        file and returns the fastest one.
+
+        Returns:
+            str: The name of the fastest engine.
+        """
+        timings = dict()
+        for engine in self.get_available_excel_engines():
+            start = time.perf_counter()
+            next(self.iter_engine_sheets(engine), None)
+            timings[engine] = time.perf_counter() - start
+        return min(timings, key=timings.get)
+
+    def iter_engine_sheets(self, engine, sheet_names = None):
+        """
+        Yields the sheets of the Excel file read with the given engine.
+
+        Args:
+            engine (str): The name of the engine, a key of self.excel_engines.
+            sheet_names (list, optional): The sheets to read. Defaults to None (all sheets).
+
+        Yields:
+            tuple: The sheet name and a DataFrame with the data of that sheet.
+        """
+        for sheet_name, rows in self.excel_engines[engine](sheet_names):
+            sheet_data = self.rows_to_sheet_data(rows)
+            if sheet_data is not None:
+                yield sheet_name, sheet_data
+
+    def iter_openpyxl_rows(self, sheet_names = None):
+        """
+        Yields the cell values of every sheet, read with a read-only openpyxl iterator.
+
+        Args:
+            sheet_names (list, optional): The sheets to read. Defaults to None (all sheets).
+
+        Yields:
+            tuple: The sheet name and a list of row tuples.
+        """
+        workbook = load_workbook(self.filename, read_only=True, data_only=True)
+        try:
+            worksheets = workbook.worksheets if sheet_names is None else [workbook[sheet_name] for sheet_name in sheet_names]
+            for worksheet in worksheets:
+                # The stored sheet dimensions can be wrong, which would truncate rows
+                worksheet.reset_dimensions()
+                yield worksheet.title, list(worksheet.iter_rows(values_only=True))
+        finally:
+            workbook.close()
+
+    def iter_calamine_rows(self, sheet_names = None):
+        """
+        Yields the cell values of every sheet, read with the Rust-based calamine library.
+
+        Calamine returns empty cells as '' and every number as float. Like
+        pd.read_excel, the integral numbers of the header block are returned as int,
+        so that metadata such as 'Trial ID' reads the same as with openpyxl.
+
+        Args:
+            sheet_names (list, optional): The sheets to read. Defaults to None (all sheets).
+
+        Yields:
+            tuple: The sheet name and a list of row tuples.
+        """
+        workbook = CalamineWorkbook.from_path(self.filename)
+        try:
+            for sheet_name in workbook.sheet_names if sheet_names is None else sheet_names:
+                rows = workbook.get_sheet_by_name(sheet_name).to_python(skip_empty_area=False)
+                for index, row in enumerate(rows):
+                    if row and row[0] == 'Trial time':
+                        break
+                    rows[index] = [int(value) if isinstance(value, float) and value.is_integer() else value for value in row]
+                yield sheet_name, [tuple(row) for row in rows]
+        finally:
+            workbook.close()
+
+    def rows_to_sheet_data(self, rows):
+        """
+        Turns the cell values of a sheet into a DataFrame laid out like the ones
+        returned by pd.read_excel: first row used as header, empty cells as NaN,
+        trailing empty rows dropped.
+
+        Args:
+            rows (list): The row tuples of the sheet.
+
+        Returns:
+            DataFrame: The sheet data, or None if the sheet has no data below its first row.
+        """
+        # Drop trailing empty rows, as pd.read_excel does
+        while rows and all(value is None or value == '' for value in rows[-1]):
+            rows.pop()
+        if len(rows) < 2:
+            return None
+
+        # Pad short rows to the sheet width
+        num_columns = max(len(row) for row in rows)
+        rows = [row + (None,) * (num_columns - len(row)) for row in rows]
+
+        header = [np.nan if value == '' else value for value in rows[0]]
+        sheet_data = pd.DataFrame(rows[1:], columns=header, dtype=object)
+        return sheet_data.where(sheet_data.notna() & (sheet_data != ''), np.nan)
 
-    def get_trajectory(self, sheet_data):
+    def parse_header(self, sheet_data):
+        """
+        Walks the header block of the given sheet data once and collects the metadata.
+
+        The first column is read until the 'Trial time' column head is found, so the
+        samples below the header are never scanned.
+
+        Args:
+            sheet_data (DataFrame): The data from a single sheet in the Excel file.
+
+        Returns:
+            tuple: A dictionary mapping the metadata keys found in the header to their
+                   values, and the row index of the column heads (None if not found).
+        """
+        meta_data = dict()
+        first_column = sheet_data.iloc[:, 0].to_numpy()
+        second_column = sheet_data.iloc[:, 1].to_numpy() if sheet_data.shape[1] > 1 else None
+
+        for index, key in enumerate(first_column):
+            if key == 'Trial time':
+                return meta_data, index
+            if key in self.meta_keys and key not in meta_data and second_column is not None:
+                meta_data[key] = second_column[index]
+
+        return meta_data, None
+
+    def get_trajectory(self, sheet_data, header_index = None):
         """
         Extracts the trajectory data from the given sheet data.
 
         Args:
             sheet_data (DataFrame): The data from a single sheet in the Excel file.
+            header_index (int, optional): The row index of the column heads as returned by
+                                          parse_header. Looked up if None. Defaults to None.
 
         Returns:
             DataFrame: A DataFrame containing the trajectory data.
         """
 
         # Find the index of the 'Trial time' in the 1st column
-        index = (sheet_data.iloc[:,0] == 'Trial time').idxmax()
-        column_heads = sheet_data.iloc[index,:].to_list()
-        column_units = sheet_data.iloc[index+1,:].to_list()
-        col_combi = list(zip(column_heads, column_units))
-        col_combi = [x for x in col_combi if x[0] in self.accepted_column_heads]
-        col_combi_indices = [i for i, x in enumerate(col_combi) if x[0] in self.accepted_column_heads]
-        column_names = [f'{x[0]}_{x[1]}'.replace(' ','_') for x in col_combi]
+        if header_index is None:
+            header_index = self.parse_header(sheet_data)[1]
+        column_heads = sheet_data.iloc[header_index,:].to_list()
+        column_units = sheet_data.iloc[header_index+1,:].to_list()
+        col_combi_indices = [i for i, head in enumerate(column_heads) if head in self.accepted_column_heads]
+        column_names = [f'{column_heads[i]}_{column_units[i]}'.replace(' ','_') for i in col_combi_indices]
 
-        return pd.DataFrame(sheet_data.iloc[index+2::,col_combi_indices].to_numpy(), columns=column_names)
+        # Only the numeric block below the column heads and units
+        return pd.DataFrame(sheet_data.iloc[header_index+2::,col_combi_indices].to_numpy(), columns=column_names)
 
-    def get_meta_data(self, sheet_data, df):
+    def get_meta_data(self, sheet_data, df, meta_data = None):
         """
         Adds metadata to the given DataFrame.
 
         Args:
             sheet_data (DataFrame): The data from a single sheet in the Excel file.
             df (DataFrame): A DataFrame containing the trajectory data.
+            meta_data (dict, optional): The metadata as returned by parse_header. Parsed from
+                                        sheet_data if None. Defaults to None.
 
         Returns:
             DataFrame: A DataFrame containing the trajectory data with metadata.
         """
-        meta_keys = ['Tank_number', 'Sex', 'ID', 'Start time', 'Arena ID', 'Trial ID', 'Subject ID']
-        
-        for key in meta_keys:
-            value = sheet_data.loc[sheet_data.iloc[:, 0] == key].iloc[:, 1].values
-            df[key.replace(' ', '_')] = value[0] if len(value) > 0 else None
+        if meta_data is None:
+            meta_data = self.parse_header(sheet_data)[0]
+
+        for key in self.meta_keys:
+            df[key.replace(' ', '_')] = meta_data.get(key)
+        df['Start_time_epoch'] = self.get_start_time_epoch(meta_data.get('Start time'))
 
         return df
+
+    def get_meta_columns(self):
+        """
+        Returns the names of the metadata columns added by get_meta_data.
+
+        Returns:
+            list: The metadata column names.
+        """
+        return [key.replace(' ', '_') for key in self.meta_keys] + ['Start_time_epoch']
+
+    def get_start_time_epoch(self, start_time):
+        """
+        Converts an EthoVision start time to integer seconds since 1970-01-01. The
+        local recording time is treated as UTC, so the calendar date of the epoch is
+        the date of the recording. It is parsed once per track, so that sorting and
+        day numbering later on work on integers instead of strings.
+
+        Args:
+            start_time (str): The start time as written by EthoVision, e.g. '04/28/2023 10:00:00.000'.
+
+        Returns:
+            int: The start time in epoch seconds, or None if it is missing or cannot be parsed.
+        """
+        start_time = pd.to_datetime(start_time, format=self.start_time_format, errors='coerce')
+        if pd.isna(start_time):
+            return None
+        return int(start_time.timestamp())
     
-   
+    def convert_to_numeric(self, df):
+        """
+        Converts all trajectory columns to numbers. EthoVision marks missing samples
+        with '-', these become NaN.
+
+        Args:
+            df (pd.DataFrame): A DataFrame containing the trajectory columns.
+
+        Returns:
+            pd.DataFrame: The numeric DataFrame.
+        """
+        return df.apply(pd.to_numeric, errors='coerce')
+
     def apply_correction_factor(self, df):
         """
-        Applies the correction factor to the 'X_center_cm' and 'Y_center_cm' columns
-        in the given DataFrame if the correction mode is set to true.
+        Converts all trajectory columns to numbers and applies the correction factor
+        to the 'X_center_cm', 'Y_center_cm', 'Area_cm²', 'Areachange_cm²' and
+        'Distance_moved_cm' columns in the given DataFrame if the correction mode is
+        set to true.
+
+        The conversion is done column-wise by convert_to_numeric and the correction
+        as one array multiply.
 
         Args:
-            df (pd.DataFrame): A DataFrame containing 'X_center_cm' and 'Y_center_cm' columns.
+            df (pd.DataFrame): A DataFrame containing the trajectory columns.
         
         Returns:
-            pd.DataFrame: A DataFrame with the corrected 'X_center_cm' and 'Y_center_cm' columns.
+            pd.DataFrame: A numeric DataFrame with the corrected columns.
         """
 
-        df['X_center_cm']       = df['X_center_cm'].replace('-', np.nan)
-        df['Y_center_cm']       = df['Y_center_cm'].replace('-', np.nan)
-        df['Area_cm²']          = df['Area_cm²'].replace('-', np.nan)
-        df['Areachange_cm²']    = df['Areachange_cm²'].replace('-', np.nan)
-        df['Distance_moved_cm'] = df['Distance_moved_cm'].replace('-', np.nan)
+        df = self.convert_to_numeric(df)
         if self.correction_mode:
-            df['X_center_cm']       = df['X_center_cm'].apply(lambda x: float(x) * self.correction_factor)
-            df['Y_center_cm']       = df['Y_center_cm'].apply(lambda x: float(x) * self.correction_factor)
-            df['Area_cm²']          = df['Area_cm²'].apply(lambda x: float(x) * self.correction_factor)
-            df['Areachange_cm²']    = df['Areachange_cm²'].apply(lambda x: float(x) * self.correction_factor)
-            df['Distance_moved_cm'] = df['Distance_moved_cm'].apply(lambda x: float(x) * self.correction_factor)
+            corrected_columns = [column for column in self.corrected_column_names if column in df.columns]
+            df[corrected_columns] = df[corrected_columns].to_numpy(dtype=float) * self.correction_factor
 
         return df
 
 
+    def apply_schema(self, df):
+        """
+        Casts the given DataFrame to the ingest schema: float32 for the measurement
+        columns, nullable integers for numeric metadata and categoricals for text
+        metadata. Text metadata is normalised to strings, so values read as numbers
+        (e.g. a numeric 'Subject ID') end up identical to values read as text.
+
+        With these dtypes pandas creates REAL, INTEGER and TEXT columns in SQLite
+        instead of storing every value as TEXT.
+
+        Args:
+            df (pd.DataFrame): A DataFrame with trajectory and metadata columns.
+
+        Returns:
+            pd.DataFrame: The DataFrame with the schema applied.
+        """
+        for column in df.columns:
+            dtype = self.meta_data_schema.get(column)
+            if dtype == 'Int64':
+                df[column] = pd.to_numeric(df[column]).astype('Int64')
+            elif dtype == 'category':
+                df[column] = df[column].astype('string').astype('category')
+            elif column not in self.meta_data_schema:
+                df[column] = df[column].astype(self.measure_dtype)
+
+        return df
+
     def plot_interpolated_coordinates(self,meta_data, original_corners, new_corners, interpolated_points):
         """
         Plots a figure with two subplots. The first subplot shows the original tank corners
@@ -193,7 +648,8 @@ class EthoVisionReader:
         """
         Interpolates the 'X_center_cm' and 'Y_center_cm' coordinates in df_trajectory,
         using the given tank_coordinates, to new coordinates based on a tank with the
-        specified tank_width and tank_height.
+        specified tank_width and tank_height. The mapping is the per-arena homography
+        returned by get_tank_transform.
 
         Args:
             meta_data (pd.DataFrame): A DataFrame containing the metadata.
@@ -206,24 +662,22 @@ class EthoVisionReader:
         """
 
 
-        # Get the arena number from the metadata
+        # Get the arena number and calibration session from the metadata
         arena_ID = int(meta_data['Arena_ID'].iloc[0])
+        session_key = self.get_session_key(meta_data)
 
-        # Get the tank corners for the corresponding tank_number
-        corners = self.tank_coordinates[arena_ID]
-
-        # Define the tank corners for the new coordinate system
-        new_corners = np.array([(0, 0), (0, self.tank_height), ( self.tank_width,  self.tank_height), ( self.tank_width, 0)])
+        # Get the cached transform for the corresponding tank
+        transform = self.get_tank_transform(arena_ID, session_key)
 
         # Prepare the points for interpolation
-        source_points = np.array([corners['lower left'], corners['upper left'], corners['upper right'], corners['lower right']])
-        target_points = np.array(meta_data[['X_center_cm', 'Y_center_cm']])
+        target_points = meta_data[['X_center_cm', 'Y_center_cm']].to_numpy(dtype=float)
 
-        # Perform the interpolation
-        interpolated_points = griddata(source_points, new_corners, target_points)
+        # Map all points to tank coordinates in one matrix operation
+        interpolated_points = self.apply_tank_transform(transform, target_points)
 
         # Plot optional
         if plot_mode:
+            source_points, new_corners = self.get_tank_corners(arena_ID, session_key)
             self.plot_interpolated_coordinates(meta_data, source_points, new_corners, interpolated_points)
 
         # Update the 'X_center_cm' and 'Y_center_cm' columns with the interpolated coordinates
@@ -232,33 +686,200 @@ class EthoVisionReader:
 
         return meta_data
 
+    def process_sheet(self, sheet_data):
+        """
+        Processes the data of a single sheet into a trajectory DataFrame with metadata.
+
+        Args:
+            sheet_data (DataFrame): The data from a single sheet in the Excel file.
+
+        Returns:
+            DataFrame: The processed trajectory data, or None if no samples were logged for this track.
+        """
+        if sheet_data.iloc[-1, 0] == 'No samples logged for this track!':
+            return None
+
+        # read the header block once
+        meta_data, header_index = self.parse_header(sheet_data)
+        # get trajectory data
+        df_trajectory = self.get_trajectory(sheet_data, header_index)
+
+        return self.process_trajectory(df_trajectory, meta_data)
+
+    def process_trajectory(self, df_trajectory, meta_data):
+        """
+        Turns the trajectory columns and metadata of one track into the final
+        trajectory DataFrame and records the tracking quality of the track.
+
+        Args:
+            df_trajectory (DataFrame): The trajectory columns as returned by get_trajectory.
+            meta_data (dict): The metadata as returned by parse_header.
+
+        Returns:
+            DataFrame: The processed trajectory data with metadata.
+        """
+        # Apply the correction factor
+        df_trajectory = self.apply_correction_factor(df_trajectory) 
+        # combine trajectory with important meta data
+        df_meta_data = self.get_meta_data(None, df_trajectory, meta_data)
+        # samples EthoVision could not track, before they are mixed with out-of-tank points
+        dropouts = df_meta_data[['X_center_cm', 'Y_center_cm']].isna().any(axis=1).to_numpy()
+        #interpolate to tank coordinates
+        df_meta_data = self.interpolate_coordinates(df_meta_data)
+        # compact, typed columns
+        df_meta_data = self.apply_schema(df_meta_data)
+        # per-trial QA summary from the same pass
+        self.tracking_quality.append(self.get_tracking_quality(df_meta_data, dropouts))
+
+        return df_meta_data
+
+    def get_tracking_quality(self, df_meta_data, dropouts):
+        """
+        Computes the tracking quality summary of one processed track.
+
+        The summary holds the trial key and metadata, the number of samples, the
+        fraction of samples EthoVision could not track ('-'), the longest time without a
+        tracked sample, the fraction of tracked samples that fall outside the tank after
+        interpolate_coordinates and whether 'Recording_time_s' is strictly increasing.
+
+        Args:
+            df_meta_data (DataFrame): The processed trajectory data with metadata.
+            dropouts (numpy.ndarray): A boolean array marking the untracked samples.
+
+        Returns:
+            dict: The tracking quality summary.
+        """
+        meta_columns = self.get_meta_columns()
+        quality = {column: df_meta_data[column].iloc[0] for column in meta_columns if column in df_meta_data.columns}
+
+        num_samples = len(df_meta_data)
+        outside = df_meta_data[['X_center_cm', 'Y_center_cm']].isna().any(axis=1).to_numpy() & ~dropouts
+        num_tracked = num_samples - dropouts.sum()
+
+        if 'Recording_time_s' in df_meta_data.columns:
+            recording_time = df_meta_data['Recording_time_s'].to_numpy(dtype=float)
+            tracked_time = recording_time[~dropouts]
+            longest_gap = np.diff(tracked_time).max() if len(tracked_time) > 1 else np.nan
+            time_monotonic = bool(np.all(np.diff(recording_time) > 0))
+        else:
+            longest_gap = np.nan
+            time_monotonic = False
+
+        quality['num_samples'] = num_samples
+        quality['dropout_fraction'] = dropouts.sum() / num_samples if num_samples > 0 else np.nan
+        quality['longest_gap_s'] = longest_gap
+        quality['out_of_bounds_fraction'] = outside.sum() / num_tracked if num_tracked > 0 else np.nan
+        quality['time_monotonic'] = time_monotonic
+
+        return quality
+
+    def get_tracking_quality_table(self):
+        """
+        Returns the tracking quality summaries of all tracks processed so far.
+
+        Returns:
+            DataFrame: One row per track, see get_tracking_quality.
+        """
+        return pd.DataFrame(list(self.tracking_quality))
+
+    def get_raw_trajectory(self, sheet_data):
+        """
+        Extracts the numeric trajectory data with metadata of a single sheet, before
+        the correction factor and the tank transform are applied.
+
+        Args:
+            sheet_data (DataFrame): The data from a single sheet in the Excel file.
+
+        Returns:
+            DataFrame: The raw trajectory data with metadata, or None if no samples were logged for this track.
+        """
+        if sheet_data.iloc[-1, 0] == 'No samples logged for this track!':
+            return None
+
+        meta_data, header_index = self.parse_header(sheet_data)
+        df_trajectory = self.convert_to_numeric(self.get_trajectory(sheet_data, header_index))
+        return self.get_meta_data(sheet_data, df_trajectory, meta_data)
+
+    def iter_trajectories(self):
+        """
+        Generator that processes the Excel file sheet by sheet.
+
+        Combined with streaming_mode this keeps only one sheet in memory at a time,
+        so each trajectory can be written out before the next sheet is parsed.
+        With num_workers > 1 the sheets are read and processed by a pool of worker
+        processes, see process_sheets_in_parallel; the order of the sheets is kept.
+
+        Yields:
+            DataFrame: The processed trajectory data with metadata of one sheet.
+        """
+        self.tracking_quality = list()
+        if self.num_workers > 1:
+            processed_sheets = self.process_sheets_in_parallel()
+        else:
+            processed_sheets = map(self.process_sheet, (sheet_data for sheet_name, sheet_data in self.iter_sheets()))
+
+        for df_meta_data in processed_sheets:
+            if df_meta_data is not None:
+                yield df_meta_data
+
+    def process_sheets_in_parallel(self):
+        """
+        Reads and processes the sheets with a pool of num_workers processes and yields
+        the results in the original sheet order.
+
+        Every worker reads its sheet from the file itself (see read_sheet) and returns
+        the processed trajectory, so both the parsing of the cells and the processing
+        run in parallel and outside the GIL of the calling process. At most
+        2 * num_workers sheets are submitted ahead of the one being yielded, so the
+        memory use stays bounded by a few sheets.
+
+        Yields:
+            DataFrame: The result of process_sheet for each sheet (None for empty tracks).
+        """
+        # Resolve 'auto' once, so the workers do not benchmark the engines again
+        engine = self.get_excel_engine()
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            pending = deque()
+
+            def next_result():
+                df_meta_data, tracking_quality = pending.popleft().result()
+                self.tracking_quality.extend(tracking_quality)
+                return df_meta_data
+
+            for sheet_name in self.get_sheet_names():
+                pending.append(executor.submit(read_and_process_sheet, self, sheet_name, engine))
+                if len(pending) >= 2 * self.num_workers:
+                    yield next_result()
+            while pending:
+                yield next_result()
+
     def main(self):
         """
         Main function to process the data from the Excel file.
 
         Returns:
-            DataFrame: A DataFrame containing the concatenated data from all sheets.
-        """
-        df_list = list()
-
-        for sheet_name, sheet_data in self.excel_data.items():
-            if sheet_data.iloc[-1, 0] != 'No samples logged for this track!':
-                # get trajectory data
-                df_trajectory = self.get_trajectory(sheet_data)
-                # Apply the correction factor
-                df_trajectory = self.apply_correction_factor(df_trajectory) 
-                # combine trajectory with important meta data
-                df_meta_data = self.get_meta_data(sheet_data, df_trajectory)
-                #interpolate to tank coordinates
-                df_meta_data = self.interpolate_coordinates(df_meta_data)
-                #save
-                df_list.append(df_meta_data)
-
-        final_data = pd.concat(df_list)
+            DataFrame: A DataFrame containing the concatenated data from all sheets
+                       (empty if no samples were logged in any sheet).
+        """
+        df_list = list(self.iter_trajectories())
+        if not df_list:
+            # only tracks without samples, common for single-track text exports
+            return pd.DataFrame()
+
+        # concatenating sheets with different categories falls back to object columns
+        final_data = self.apply_schema(pd.concat(df_list))
         return final_data
 
 # Example usage:
 # filename = "/home/bgeurten/Downloads/Raw_data-2023_setup-Trial1.xlsx"
 # etho_vision_reader = EthoVisionReader(filename,correction_mode=True)
 # final_data = etho_vision_reader.main()
-# print(final_data)
\ No newline at end of file
+# print(final_data)
+#
+# Streaming usage, one sheet in memory at a time:
+# etho_vision_reader = EthoVisionReader(filename, streaming_mode=True)
+# for df_sheet in etho_vision_reader.iter_trajectories():
+#     print(df_sheet)
+#
+# Reading and processing the sheets of one big workbook with four processes:
+# final_data = EthoVisionReader(filename, excel_engine='calamine', num_workers=4).main()
\ No newline at end of file
@@ -0,0 +1,203 @@
+import csv
+import os
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from data_handlers.EthoVisionReader import EthoVisionReader
+
+
+class EthoVisionSyntheticData:
+    """
+    A class to write synthetic EthoVision exports for testing and benchmarking the ingest.
+
+    The files mimic the EthoVision raw data exports: a header block with the metadata
+    keys read by EthoVisionReader.get_meta_data, the column heads and units, and the
+    samples of a random walk inside the arena corners of EthoVisionReader. Untracked
+    samples are written as '-'. Each trial is written as one workbook with one sheet
+    per arena, or as one text export per arena. The samples of a track only depend on
+    the seed, the trial and the arena, so both formats hold the same data.
+
+    Attributes:
+        num_arenas (int): The number of arenas (tracks) per trial, at most 4.
+        num_trials (int): The number of trials, one per day.
+        duration_s (float): The duration of each track in seconds.
+        fps (int): The frames per second of the recording.
+        dropout_rate (float): The fraction of untracked samples.
+        num_empty_tracks (int): The number of 'No samples logged' tracks per trial.
+        seed (int): The seed the random numbers of every track are derived from.
+    """
+    def __init__(self, num_arenas = 4, num_trials = 1, duration_s = 60.0, fps = 25, dropout_rate = 0.02, num_empty_tracks = 1, seed = 0):
+        self.num_arenas = num_arenas
+        self.num_trials = num_trials
+        self.duration_s = duration_s
+        self.fps = fps
+        self.dropout_rate = dropout_rate
+        self.num_empty_tracks = num_empty_tracks
+        self.seed = seed
+
+        self.column_heads = ['Trial time', 'Recording time', 'X center', 'Y center', 'Area', 'Areachange',
+                             'Elongation', 'Distance moved', 'Velocity', 'Result 1']
+        self.column_units = ['s', 's', 'cm', 'cm', 'cm²', 'cm²', None, 'cm', 'cm/s', None]
+        self.tank_coordinates = EthoVisionReader(None, streaming_mode=True).tank_coordinates
+        self.start_date = pd.Timestamp('2023-04-28 10:00:00')
+
+    def get_header_rows(self, trial, arena):
+        """
+        Returns the header block of one track, ending before the column heads.
+
+        Args:
+            trial (int): The trial number, used as day offset of the start time.
+            arena (int): The arena number.
+
+        Returns:
+            list: The header rows as [key, value] lists.
+        """
+        start_time = (self.start_date + pd.Timedelta(days=trial)).strftime('%m/%d/%Y %H:%M:%S.000')
+        header_rows = [['Number of header lines:', None],
+                       ['Experiment', 'Synthetic'],
+                       ['Trial name', f'Trial     {trial + 1}'],
+                       ['Trial ID', trial + 1],
+                       ['Arena name', f'Arena {arena + 1}'],
+                       ['Arena ID', arena],
+                       ['Subject name', 'Subject 1'],
+                       ['Subject ID', f'Subject {arena + 1}'],
+                       ['Start time', start_time],
+                       ['Tank_number', arena + 1],
+                       ['Sex', 'M' if arena % 2 else 'F'],
+                       ['ID', 'A'],
+                       [None, None]]
+        # EthoVision counts the column heads and units as header lines too
+        header_rows[0][1] = len(header_rows) + 2
+        return header_rows
+
+    def get_samples(self, trial, arena):
+        """
+        Simulates the samples of one track as a random walk inside the arena.
+
+        Args:
+            trial (int): The trial number.
+            arena (int): The arena number.
+
+        Returns:
+            list: The sample rows, with '-' for untracked samples.
+        """
+        rng = np.random.default_rng([self.seed, trial, arena])
+        num_samples = int(self.duration_s * self.fps)
+        corners = np.array(list(self.tank_coordinates[arena].values()))
+        lower, upper = corners.min(axis=0), corners.max(axis=0)
+
+        steps = rng.normal(0, 0.1, size=(num_samples, 2))
+        positions = (upper + lower) / 2 + np.cumsum(steps, axis=0)
+        # reflect the walk at the arena walls
+        span = upper - lower
+        positions = np.abs((positions - lower) % (2 * span) - span)
+        positions = upper - positions
+
+        time = np.arange(num_samples) / self.fps
+        distance = np.r_[0, np.linalg.norm(np.diff(positions, axis=0), axis=1)]
+        area = rng.normal(0.3, 0.02, size=num_samples)
+        dropouts = rng.random(num_samples) < self.dropout_rate
+
+        samples = np.column_stack([time, time, positions, area, np.r_[0, np.abs(np.diff(area))],
+                                   rng.uniform(0.3, 0.7, size=num_samples), distance, distance * self.fps,
+                                   np.ones(num_samples)]).tolist()
+        for i in np.flatnonzero(dropouts):
+            samples[i][2:9] = ['-'] * 7
+        return samples
+
+    def get_track_rows(self, trial, arena):
+        """
+        Returns all rows of one track: header block, column heads, units and samples.
+
+        Args:
+            trial (int): The trial number.
+            arena (int): The arena number, or None for a track without samples.
+
+        Returns:
+            list: The rows of the track.
+        """
+        if arena is None:
+            header_rows = self.get_header_rows(trial, 0)
+            return header_rows + [self.column_heads, self.column_units, ['No samples logged for this track!']]
+        return self.get_header_rows(trial, arena) + [self.column_heads, self.column_units] + self.get_samples(trial, arena)
+
+    def get_tracks(self, trial):
+        """
+        Returns the track names and arenas of one trial, including the empty tracks.
+
+        Args:
+            trial (int): The trial number.
+
+        Returns:
+            list: (track name, arena or None) tuples.
+        """
+        tracks = [(f'Track-Arena {arena + 1}-Subject 1', arena) for arena in range(self.num_arenas)]
+        tracks += [(f'Track-Empty {i + 1}', None) for i in range(self.num_empty_tracks)]
+        return tracks
+
+    def write_workbook(self, filename, trial):
+        """
+        Writes one trial as an Excel workbook with one sheet per track.
+
+        Args:
+            filename (str): The filename of the workbook.
+            trial (int): The trial number.
+        """
+        workbook = Workbook(write_only=True)
+        for track_name, arena in self.get_tracks(trial):
+            worksheet = workbook.create_sheet(track_name[:31])
+            for row in self.get_track_rows(trial, arena):
+                worksheet.append(row)
+        workbook.save(filename)
+
+    def write_text_exports(self, folder, trial, delimiter = ';', encoding = 'utf-8'):
+        """
+        Writes one trial as EthoVision text exports, one file per track.
+
+        Args:
+            folder (str): The folder to write the files to.
+            trial (int): The trial number.
+            delimiter (str, optional): The field delimiter. Defaults to ';'.
+            encoding (str, optional): The text encoding. Defaults to 'utf-8'.
+
+        Returns:
+            list: The paths of the written files.
+        """
+        filenames = list()
+        for track_name, arena in self.get_tracks(trial):
+            filename = os.path.join(folder, f'Trial{trial + 1}-{track_name}.txt')
+            with open(filename, 'w', newline='', encoding=encoding) as f:
+                writer = csv.writer(f, delimiter=delimiter, quoting=csv.QUOTE_ALL)
+                for row in self.get_track_rows(trial, arena):
+                    writer.writerow(['' if value is None else value for value in row])
+            filenames.append(filename)
+        return filenames
+
+    def write_campaign(self, folder, file_format = 'xlsx'):
+        """
+        Writes all trials to the given folder.
+
+        Args:
+            folder (str): The folder to write the files to.
+            file_format (str, optional): 'xlsx' for workbooks or 'txt' for text exports. Defaults to 'xlsx'.
+
+        Returns:
+            list: The paths of the written files.
+        """
+        os.makedirs(folder, exist_ok=True)
+        filenames = list()
+        for trial in range(self.num_trials):
+            if file_format == 'xlsx':
+                filename = os.path.join(folder, f'Raw_data-Synthetic-Trial{trial + 1}.xlsx')
+                self.write_workbook(filename, trial)
+                filenames.append(filename)
+            elif file_format == 'txt':
+                filenames += self.write_text_exports(folder, trial)
+            else:
+                raise ValueError(f"file_format must be 'xlsx' or 'txt', not {file_format!r}")
+        return filenames
+
+# Example usage:
+# generator = EthoVisionSyntheticData(num_arenas=4, num_trials=3, duration_s=3600)
+# xlsx_files = generator.write_campaign('/tmp/synthetic_ethovision/xlsx', 'xlsx')
+# txt_files = generator.write_campaign('/tmp/synthetic_ethovision/txt', 'txt')
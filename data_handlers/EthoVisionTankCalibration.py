@@ -0,0 +1,257 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from scipy.spatial import ConvexHull, QhullError
+
+
+class EthoVisionTankCalibration:
+    """
+    A class to estimate the tank corners of every arena from the tracked positions.
+
+    The corners hard-coded in EthoVisionReader.set_tank_corner_coordinates are only
+    valid as long as the camera does not move. This class estimates them per session
+    (recording date) and arena from the combined point cloud of all tracks: the cloud
+    is trimmed to robust percentile extents, reduced to its convex hull, and the hull
+    points furthest towards the four diagonal directions are taken as the corners.
+    Estimates whose size, shape or position deviate too far from the hard-coded
+    corners of the arena are rejected (see is_plausible), and those arenas keep
+    the hard-coded corners. The calibrations are cached in a JSON file, so a rig change only needs one pass
+    over the new recordings. An EthoVisionReader constructed with a calibration uses
+    the corners of the session of each track, and its hard-coded corners for sessions
+    that have not been calibrated.
+
+    Attributes:
+        cache_filename (str): The JSON file the calibrations are stored in. None to keep them in memory.
+        lower_percentile (float): The lower percentile of the robust extents.
+        upper_percentile (float): The upper percentile of the robust extents.
+        min_samples (int): The minimum number of tracked samples to calibrate an arena.
+        max_size_deviation (float): The maximum relative deviation of the estimated tank width
+                                    and height from those of the hard-coded corners.
+        max_corner_offset (float): The maximum distance of an estimated corner from the hard-coded
+                                   one, after both are centred, in EthoVision coordinates.
+        max_shift (float): The maximum distance of the estimated tank centre from the hard-coded one.
+        calibrations (dict): Maps the session key to a dictionary mapping the arena number
+                             to its corners, laid out like EthoVisionReader.tank_coordinates.
+    """
+    def __init__(self, cache_filename = None, lower_percentile = 0.1, upper_percentile = 99.9, min_samples = 1000,
+                 max_size_deviation = 0.1, max_corner_offset = 2.0, max_shift = 5.0):
+        """
+        Constructs the EthoVisionTankCalibration object and loads the cached calibrations.
+
+        Args:
+            cache_filename (str, optional): The JSON file with the cached calibrations. Defaults to None.
+            lower_percentile (float, optional): The lower percentile of the robust extents. Defaults to 0.1.
+            upper_percentile (float, optional): The upper percentile of the robust extents. Defaults to 99.9.
+            min_samples (int, optional): The minimum number of tracked samples per arena. Defaults to 1000.
+            max_size_deviation (float, optional): The maximum relative deviation of width and height. Defaults to 0.1.
+            max_corner_offset (float, optional): The maximum offset of a centred corner. Defaults to 2.0.
+            max_shift (float, optional): The maximum shift of the tank centre. Defaults to 5.0.
+        """
+        self.cache_filename = cache_filename
+        self.lower_percentile = lower_percentile
+        self.upper_percentile = upper_percentile
+        self.min_samples = min_samples
+        self.max_size_deviation = max_size_deviation
+        self.max_corner_offset = max_corner_offset
+        self.max_shift = max_shift
+        self.corner_names = ['lower left', 'upper left', 'upper right', 'lower right']
+        # Directions pointing from the tank centre to the corners, in corner_names order
+        self.corner_directions = np.array([(-1, -1), (-1, 1), (1, 1), (1, -1)], dtype=float)
+        self.calibrations = self.load_cache()
+
+    def load_cache(self):
+        """
+        Loads the calibrations from the cache file.
+
+        Returns:
+            dict: The cached calibrations, empty if there is no cache file.
+        """
+        if self.cache_filename is None or not os.path.exists(self.cache_filename):
+            return dict()
+        with open(self.cache_filename) as f:
+            cache = json.load(f)
+        return {session_key: {int(arena_ID): {name: tuple(point) for name, point in corners.items()}
+                              for arena_ID, corners in arenas.items()}
+                for session_key, arenas in cache.items()}
+
+    def save_cache(self):
+        """
+        Writes the calibrations to the cache file, if one is set.
+
+        Returns:
+            None
+        """
+        if self.cache_filename is None:
+            return
+        cache = {session_key: {str(arena_ID): {name: list(point) for name, point in corners.items()}
+                               for arena_ID, corners in arenas.items()}
+                 for session_key, arenas in self.calibrations.items()}
+        with open(self.cache_filename, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+
+    def get_session_key(self, start_time_epoch):
+        """
+        Returns the session key (recording date) of a track.
+
+        Args:
+            start_time_epoch (int): The start time of the track in epoch seconds.
+
+        Returns:
+            str: The recording date as 'YYYY-MM-DD', or None if the start time is missing.
+        """
+        if start_time_epoch is None or pd.isna(start_time_epoch):
+            return None
+        return pd.Timestamp(int(start_time_epoch), unit='s').strftime('%Y-%m-%d')
+
+    def get_tank_coordinates(self, session_key, arena_ID):
+        """
+        Returns the calibrated corners of an arena in a session.
+
+        Args:
+            session_key (str): The session key returned by get_session_key.
+            arena_ID (int): The arena number.
+
+        Returns:
+            dict: The corners, laid out like an entry of EthoVisionReader.tank_coordinates,
+                  or None if the arena has not been calibrated for this session.
+        """
+        return self.calibrations.get(session_key, dict()).get(arena_ID)
+
+    def estimate_corners(self, points):
+        """
+        Estimates the corners of a tank from the positions tracked in it.
+
+        Untracked samples are dropped and the cloud is trimmed to the percentile
+        extents of both axes, which removes tracking glitches outside the tank. The
+        corners are the points of the convex hull of the remaining cloud that lie
+        furthest towards the lower left, upper left, upper right and lower right.
+
+        Args:
+            points (numpy.ndarray): An Nx2 array of EthoVision coordinates.
+
+        Returns:
+            dict: The corners, laid out like an entry of EthoVisionReader.tank_coordinates,
+                  or None if there are too few samples to estimate them.
+        """
+        points = np.asarray(points, dtype=float)
+        points = points[~np.isnan(points).any(axis=1)]
+        if len(points) < self.min_samples:
+            return None
+
+        lower, upper = np.percentile(points, [self.lower_percentile, self.upper_percentile], axis=0)
+        points = points[((points >= lower) & (points <= upper)).all(axis=1)]
+
+        try:
+            hull_points = points[ConvexHull(points).vertices]
+        except QhullError:
+            # all samples on a line or a point
+            return None
+
+        # Normalise to the extents, so the diagonals fit tanks that are not square
+        scaled_points = (hull_points - (lower + upper) / 2) / np.maximum(upper - lower, np.finfo(float).eps)
+        corner_indices = np.argmax(scaled_points @ self.corner_directions.T, axis=0)
+
+        return {name: tuple(float(value) for value in hull_points[i]) for name, i in zip(self.corner_names, corner_indices)}
+
+    def is_plausible(self, corners, reference_corners):
+        """
+        Checks an estimate against the hard-coded corners of the arena. A moved camera
+        shifts the tank a little but cannot change its size or shape, so the estimate
+        is rejected if its width or height deviates by more than max_size_deviation,
+        if a corner is more than max_corner_offset away from the hard-coded one once
+        both tanks are centred, or if the centre moved by more than max_shift.
+
+        Args:
+            corners (dict): The estimated corners, as returned by estimate_corners.
+            reference_corners (dict): The hard-coded corners of the arena, an entry of
+                                      EthoVisionReader.tank_coordinates.
+
+        Returns:
+            bool: True if the estimate can be used.
+        """
+        estimate = np.array([corners[name] for name in self.corner_names], dtype=float)
+        reference = np.array([reference_corners[name] for name in self.corner_names], dtype=float)
+
+        def get_size(points):
+            # corner_names order: lower left, upper left, upper right, lower right
+            width = (np.linalg.norm(points[2] - points[1]) + np.linalg.norm(points[3] - points[0])) / 2
+            height = (np.linalg.norm(points[1] - points[0]) + np.linalg.norm(points[2] - points[3])) / 2
+            return np.array([width, height])
+
+        size_deviation = np.abs(get_size(estimate) / get_size(reference) - 1)
+        shift = estimate.mean(axis=0) - reference.mean(axis=0)
+        corner_offsets = np.linalg.norm(estimate - shift - reference, axis=1)
+
+        return bool(np.all(size_deviation <= self.max_size_deviation) and
+                    np.all(corner_offsets <= self.max_corner_offset) and
+                    np.linalg.norm(shift) <= self.max_shift)
+
+    def collect_points(self, etho_vision_reader, points):
+        """
+        Adds the tracked positions of all tracks of a reader to the point clouds.
+
+        The positions are taken before the tank transform, with the correction factor
+        of the reader applied, i.e. in the coordinates of EthoVisionReader.tank_coordinates.
+
+        Args:
+            etho_vision_reader (EthoVisionReader): The reader of a workbook, text export or archive.
+            points (dict): Maps (session key, arena number) to a list of Nx2 arrays. Updated in place.
+
+        Returns:
+            None
+        """
+        for sheet_name, sheet_data in etho_vision_reader.iter_sheets():
+            df_raw = etho_vision_reader.get_raw_trajectory(sheet_data)
+            if df_raw is None or pd.isna(df_raw['Arena_ID'].iloc[0]):
+                continue
+
+            xy = df_raw[['X_center_cm', 'Y_center_cm']].to_numpy(dtype=float)
+            if etho_vision_reader.correction_mode:
+                xy = xy * etho_vision_reader.correction_factor
+
+            key = (self.get_session_key(df_raw['Start_time_epoch'].iloc[0]), int(df_raw['Arena_ID'].iloc[0]))
+            points.setdefault(key, list()).append(xy)
+
+    def calibrate(self, etho_vision_readers, overwrite = False):
+        """
+        Estimates the corners of every session and arena found in the given readers
+        and stores them in the cache file. Sessions that are already calibrated are
+        kept unless overwrite is set. Estimates that fail is_plausible against the
+        hard-coded corners of the readers are reported and not stored, so these
+        arenas keep the hard-coded corners.
+
+        Args:
+            etho_vision_readers (iterable): EthoVision readers, ideally in streaming mode.
+            overwrite (bool, optional): If True, calibrated sessions are estimated again. Defaults to False.
+
+        Returns:
+            dict: Maps the newly calibrated session keys to their arena corners.
+        """
+        points = dict()
+        reference_coordinates = None
+        for etho_vision_reader in etho_vision_readers:
+            self.collect_points(etho_vision_reader, points)
+            reference_coordinates = etho_vision_reader.tank_coordinates
+
+        new_calibrations = dict()
+        for (session_key, arena_ID), arena_points in points.items():
+            if session_key is None or (session_key in self.calibrations and not overwrite):
+                continue
+            corners = self.estimate_corners(np.concatenate(arena_points))
+            if corners is None:
+                print(f'Too few samples to calibrate arena {arena_ID} of session {session_key}')
+                continue
+            if not 0 <= arena_ID < len(reference_coordinates) or not self.is_plausible(corners, reference_coordinates[arena_ID]):
+                print(f'Rejected the implausible calibration of arena {arena_ID} of session {session_key}, keeping the hard-coded corners')
+                continue
+            new_calibrations.setdefault(session_key, dict())[arena_ID] = corners
+
+        self.calibrations.update(new_calibrations)
+        self.save_cache()
+        return new_calibrations
+
+# Example usage:
+# tank_calibration = EthoVisionTankCalibration("/home/bgeurten/fishDataBase/tank_calibration.json")
+# tank_calibration.calibrate([EthoVisionReader(file, streaming_mode=True) for file in xlsx_files])
+# final_data = EthoVisionReader(xlsx_files[0], tank_calibration=tank_calibration).main()
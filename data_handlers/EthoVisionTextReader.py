@@ -0,0 +1,247 @@
+import csv
+import os
+import pandas as pd
+import numpy as np
+from data_handlers.EthoVisionReader import EthoVisionReader
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+except ImportError:
+    pa = None
+
+
+class EthoVisionTextReader(EthoVisionReader):
+    """
+    A class to read EthoVision raw data text exports and extract trajectory and metadata.
+
+    EthoVision writes one track per text file: a block of "key;value" header lines,
+    the column heads, the column units and the samples. The header block is parsed
+    line by line, the samples with the pyarrow CSV reader (pandas' C parser if pyarrow
+    is not installed). The result of main() is identical to that of EthoVisionReader
+    for the same track exported as Excel.
+
+    Attributes:
+        filename (str): The filename of the text export to read.
+        encoding (str): The text encoding of the file. Detected from its byte order mark if None.
+        excel_data (dict): A dictionary mapping the track name to its parsed header and
+                           trajectory data. None in streaming mode.
+    """
+
+    def __init__(self, filename, encoding = None, **kwargs):
+        """
+        Constructs the EthoVisionTextReader object with the given filename.
+
+        Args:
+            filename (str): The filename of the text export to read.
+            encoding (str, optional): The text encoding. Detected from the byte order
+                                      mark if None. Defaults to None.
+            **kwargs: Passed on to EthoVisionReader (tank size, correction and streaming mode).
+        """
+        self.encoding = encoding
+        super().__init__(filename, **kwargs)
+
+    def detect_encoding(self):
+        """
+        Detects the text encoding of the file from its byte order mark.
+
+        Returns:
+            str: 'utf-16' or 'utf-8-sig' if the matching byte order mark is present, 'utf-8' otherwise.
+        """
+        with open(self.filename, 'rb') as f:
+            start = f.read(3)
+        if start[:2] in (b'\xff\xfe', b'\xfe\xff'):
+            return 'utf-16'
+        if start == b'\xef\xbb\xbf':
+            return 'utf-8-sig'
+        return 'utf-8'
+
+    def detect_delimiter(self, line):
+        """
+        Detects the field delimiter from the first header line.
+
+        Args:
+            line (str): The first line of the file.
+
+        Returns:
+            str: The delimiter, one of ';', tab or ','.
+        """
+        for delimiter in [';', '\t', ',']:
+            if delimiter in line:
+                return delimiter
+        return ';'
+
+    def read_header(self, encoding):
+        """
+        Reads the header block of the text export up to and including the units row.
+
+        Args:
+            encoding (str): The text encoding of the file.
+
+        Returns:
+            tuple: The list of header rows (each a list of strings), the delimiter,
+                   the number of lines read and the first data row (None if the
+                   track has no samples).
+        """
+        header_rows = list()
+        with open(self.filename, newline='', encoding=encoding) as f:
+            first_line = f.readline()
+            delimiter = self.detect_delimiter(first_line)
+            line = first_line
+            while line:
+                row = next(csv.reader([line], delimiter=delimiter), [])
+                header_rows.append(row)
+                if row and row[0] == 'Trial time':
+                    header_rows.append(next(csv.reader([f.readline()], delimiter=delimiter), []))
+                    data_line = f.readline()
+                    first_data_row = next(csv.reader([data_line], delimiter=delimiter), None) if data_line.strip() else None
+                    return header_rows, delimiter, len(header_rows), first_data_row
+                line = f.readline()
+
+        return header_rows, delimiter, len(header_rows), None
+
+    def read_data_block(self, encoding, delimiter, skip_rows, num_columns, column_indices):
+        """
+        Reads the samples of the text export into a numeric DataFrame.
+
+        Args:
+            encoding (str): The text encoding of the file.
+            delimiter (str): The field delimiter.
+            skip_rows (int): The number of header lines before the first sample.
+            num_columns (int): The number of fields per sample line.
+            column_indices (list): The indices of the columns to read.
+
+        Returns:
+            DataFrame: A DataFrame with one float column per selected index, named by position.
+        """
+        column_names = [f'c{i}' for i in range(num_columns)]
+        include_columns = [column_names[i] for i in column_indices]
+
+        if pa is not None:
+            table = pa_csv.read_csv(
+                self.filename,
+                read_options=pa_csv.ReadOptions(skip_rows=skip_rows, column_names=column_names, encoding=encoding),
+                parse_options=pa_csv.ParseOptions(delimiter=delimiter),
+                convert_options=pa_csv.ConvertOptions(include_columns=include_columns,
+                                                      column_types={name: pa.float64() for name in include_columns},
+                                                      null_values=['-', ''], strings_can_be_null=True))
+            return table.to_pandas()
+
+        return pd.read_csv(self.filename, sep=delimiter, skiprows=skip_rows, header=None, names=column_names,
+                           usecols=include_columns, na_values=['-'], encoding=encoding, dtype=float)[include_columns]
+
+    def read_track(self):
+        """
+        Reads the text export into a header DataFrame and a trajectory DataFrame.
+
+        The header DataFrame is laid out like an Excel sheet read by EthoVisionReader
+        (first line used as header, empty fields as NaN), so get_meta_data works on it
+        unchanged. The trajectory columns are named and selected as in get_trajectory.
+
+        Returns:
+            tuple: The header DataFrame and the trajectory DataFrame (None if no samples
+                   were logged for this track).
+        """
+        encoding = self.encoding or self.detect_encoding()
+        header_rows, delimiter, skip_rows, first_data_row = self.read_header(encoding)
+
+        header_data = pd.DataFrame(header_rows[1:], dtype=object)
+        header_data = header_data.where(header_data.notna() & (header_data != ''), np.nan)
+
+        if first_data_row is None or first_data_row[0].startswith('No samples logged'):
+            return header_data, None
+
+        column_heads = header_rows[-2]
+        column_units = [unit if unit != '' else np.nan for unit in header_rows[-1]]
+        col_combi_indices = [i for i, head in enumerate(column_heads) if head in self.accepted_column_heads]
+        column_names = [f'{column_heads[i]}_{column_units[i]}'.replace(' ','_') for i in col_combi_indices]
+
+        num_columns = max(len(column_heads), len(first_data_row))
+        df_trajectory = self.read_data_block(encoding, delimiter, skip_rows, num_columns, col_combi_indices)
+        df_trajectory.columns = column_names
+
+        return header_data, df_trajectory
+
+    def read_file(self):
+        """
+        Reads the text export and stores the track in a dictionary.
+
+        Returns:
+            dict: A dictionary mapping the track name to a (header DataFrame, trajectory DataFrame) tuple.
+        """
+        return {os.path.basename(self.filename): self.read_track()}
+
+    def iter_sheets(self):
+        """
+        Yields the single track of the text export.
+
+        Yields:
+            tuple: The track name and a (header DataFrame, trajectory DataFrame) tuple.
+        """
+        if self.excel_data is not None:
+            yield from self.excel_data.items()
+        else:
+            yield os.path.basename(self.filename), self.read_track()
+
+    def get_sheet_names(self):
+        """
+        Returns the name of the single track of the text export.
+
+        Returns:
+            list: The track name.
+        """
+        return [os.path.basename(self.filename)]
+
+    def read_sheet(self, sheet_name, engine = None):
+        """
+        Reads the single track of the text export.
+
+        Args:
+            sheet_name (str): The track name returned by get_sheet_names.
+            engine (str, optional): Ignored, text exports are not read with an Excel engine.
+
+        Returns:
+            tuple: The header DataFrame and trajectory DataFrame returned by read_track.
+        """
+        if self.excel_data is not None:
+            return self.excel_data.get(sheet_name)
+        return self.read_track()
+
+    def get_raw_trajectory(self, track):
+        """
+        Returns the numeric trajectory data with metadata of a parsed track, before the
+        correction factor and the tank transform are applied.
+
+        Args:
+            track (tuple): The header DataFrame and trajectory DataFrame returned by read_track.
+
+        Returns:
+            DataFrame: The raw trajectory data with metadata, or None if no samples were logged for this track.
+        """
+        header_data, df_trajectory = track
+        if df_trajectory is None:
+            return None
+        return self.get_meta_data(header_data, df_trajectory.copy())
+
+    def process_sheet(self, track):
+        """
+        Processes a parsed track into a trajectory DataFrame with metadata, in the
+        same steps as EthoVisionReader.process_sheet.
+
+        Args:
+            track (tuple): The header DataFrame and trajectory DataFrame returned by read_track.
+
+        Returns:
+            DataFrame: The processed trajectory data, or None if no samples were logged for this track.
+        """
+        header_data, df_trajectory = track
+        if df_trajectory is None:
+            return None
+
+        return self.process_trajectory(df_trajectory, self.parse_header(header_data)[0])
+
+# Example usage:
+# filename = "/home/bgeurten/Downloads/Track-Raw_data-2023_setup-Trial1-Arena 1-Subject 1.txt"
+# etho_vision_reader = EthoVisionTextReader(filename)
+# final_data = etho_vision_reader.main()
+# print(final_data)
@@ -0,0 +1,159 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class EthoVisionConnectionPool:
+    """
+    A pool of read-only SQLite connections that can be used from several threads
+    and processes at once.
+
+    The connections are opened with the URI mode=ro (optionally with a shared page
+    cache) and check_same_thread=False, and are handed out one at a time by the
+    connection() context manager, so no two workers ever use the same connection
+    concurrently. The database is switched to WAL journal mode once, so that the
+    readers neither block nor are blocked by a running ingest. The pool can be
+    pickled: a copy sent to a worker process opens its own connections there.
+
+    Attributes:
+        db_name (str): The path of the SQLite database.
+        pool_size (int): The maximum number of open connections.
+        shared_cache (bool): If True, the connections of a process share one page cache.
+        timeout (float): The number of seconds to wait for a free connection, None to wait forever.
+    """
+    def __init__(self, db_name, pool_size = 4, shared_cache = True, timeout = None):
+        """
+        Constructs the EthoVisionConnectionPool object and switches the database to WAL mode.
+
+        Args:
+            db_name (str): The path of the SQLite database.
+            pool_size (int, optional): The maximum number of open connections. Defaults to 4.
+            shared_cache (bool, optional): If True, the connections share one page cache. Defaults to True.
+            timeout (float, optional): The number of seconds to wait for a free connection. Defaults to None.
+        """
+        self.db_name = db_name
+        self.pool_size = pool_size
+        self.shared_cache = shared_cache
+        self.timeout = timeout
+        self.enable_wal()
+        self.reset()
+
+    def __getstate__(self):
+        # Connections, queues and locks cannot be pickled, they are recreated by reset
+        return {'db_name': self.db_name, 'pool_size': self.pool_size,
+                'shared_cache': self.shared_cache, 'timeout': self.timeout}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.reset()
+
+    def reset(self):
+        """
+        Starts an empty pool for the current process.
+
+        Returns:
+            None
+        """
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.idle_connections = queue.LifoQueue()
+        self.connections = list()
+
+    def enable_wal(self):
+        """
+        Switches the database to WAL journal mode. The mode is stored in the database
+        file, so it needs one writable connection once; read-only connections cannot
+        change it.
+
+        Returns:
+            None
+        """
+        try:
+            db_connection = sqlite3.connect(self.db_name)
+            db_connection.execute('PRAGMA journal_mode=WAL;')
+            db_connection.close()
+        except sqlite3.Error as e:
+            print(f"Could not switch the database to WAL mode: {e}")
+
+    def open_connection(self):
+        """
+        Opens a new read-only connection to the database.
+
+        Returns:
+            sqlite3.Connection: The connection.
+        """
+        uri = Path(self.db_name).absolute().as_uri() + '?mode=ro'
+        if self.shared_cache:
+            uri += '&cache=shared'
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    def checkout(self):
+        """
+        Takes a connection from the pool, opening a new one while there are fewer
+        than pool_size, and waiting for a free one otherwise.
+
+        Returns:
+            sqlite3.Connection: The connection.
+        """
+        if os.getpid() != self.pid:
+            # Forked into a new process, the connections of the parent must not be used
+            self.reset()
+
+        try:
+            return self.idle_connections.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            open_new = len(self.connections) < self.pool_size
+            if open_new:
+                db_connection = self.open_connection()
+                self.connections.append(db_connection)
+        if open_new:
+            return db_connection
+        return self.idle_connections.get(timeout=self.timeout)
+
+    def checkin(self, db_connection):
+        """
+        Returns a connection to the pool.
+
+        Args:
+            db_connection (sqlite3.Connection): A connection taken by checkout.
+
+        Returns:
+            None
+        """
+        if db_connection in self.connections:
+            self.idle_connections.put(db_connection)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that lends a connection of the pool to the caller:
+
+            with pool.connection() as db_connection:
+                df = pd.read_sql_query(query, db_connection)
+
+        Yields:
+            sqlite3.Connection: A read-only connection, used by this caller only.
+        """
+        db_connection = self.checkout()
+        try:
+            yield db_connection
+        finally:
+            self.checkin(db_connection)
+
+    def close(self):
+        """
+        Closes all connections of the pool.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            for db_connection in self.connections:
+                db_connection.close()
+            self.reset()
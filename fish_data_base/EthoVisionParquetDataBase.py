@@ -0,0 +1,246 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from urllib.parse import quote, unquote
+
+
+class EthoVisionParquetDataBase:
+    """
+    A Parquet dataset with the interface of EthoVisionSQLdataBase.
+
+    The samples are stored as a hive-partitioned Parquet dataset,
+    <db_name>/Tank_number=<n>/ID=<id>/Day=<YYYY-MM-DD>/, with one file per trial.
+    A subject is therefore read from its own directory, only the requested columns
+    are decoded, and the files are sorted by 'Recording_time_s' and carry row-group
+    statistics, so filters on it skip whole row groups. Writing a trial again
+    replaces its file, so the ingest is idempotent.
+
+    Attributes:
+        db_name (str): The root directory of the dataset.
+        partition_columns (list): The partition keys, in directory order.
+        row_group_size (int): The number of rows per row group.
+    """
+    def __init__(self, db_name, row_group_size = 65536):
+        """
+        Opens the dataset, creating its root directory if needed.
+
+        Args:
+            db_name (str): The root directory of the dataset.
+            row_group_size (int, optional): The number of rows per row group of new files. Defaults to 65536.
+        """
+        self.db_name = db_name
+        self.row_group_size = row_group_size
+        self.partition_columns = ['Tank_number', 'ID', 'Day']
+        self.start_time_format = '%m/%d/%Y %H:%M:%S.%f'
+        os.makedirs(self.db_name, exist_ok=True)
+
+    def is_open(self):
+        """
+        Checks whether the dataset directory exists.
+
+        Returns:
+            bool: True if queries can be run.
+        """
+        return os.path.isdir(self.db_name)
+
+    def get_partition_path(self, values):
+        """
+        Returns the directory of a partition.
+
+        Args:
+            values (list): The values of the partition columns.
+
+        Returns:
+            str: The directory path.
+        """
+        segments = [f'{column}={quote(str(value), safe="")}' for column, value in zip(self.partition_columns, values)]
+        return os.path.join(self.db_name, *segments)
+
+    def get_recording_days(self, df):
+        """
+        Returns the recording date of every row, the 'Day' partition key.
+
+        Args:
+            df (DataFrame): Rows with 'Start_time_epoch' or 'Start_time'.
+
+        Returns:
+            Series: The dates as 'YYYY-MM-DD' strings.
+        """
+        if 'Start_time_epoch' in df.columns and df['Start_time_epoch'].notna().all():
+            start_times = pd.to_datetime(df['Start_time_epoch'].astype('int64'), unit='s')
+        else:
+            start_times = pd.to_datetime(df['Start_time'].astype(str), format=self.start_time_format, errors='coerce')
+        return start_times.dt.strftime('%Y-%m-%d').fillna('unknown')
+
+    def write_data(self, df):
+        """
+        Writes trajectory data, as returned by the EthoVision readers or by
+        EthoVisionSQLdataBase, to the dataset. Every trial is written to its own file,
+        replacing an earlier file of the same trial.
+
+        Args:
+            df (DataFrame): The trajectory data with metadata of one or more trials.
+
+        Returns:
+            int: The number of trials written.
+        """
+        if df.empty:
+            return 0
+
+        missing_subject = df['Tank_number'].isna() | df['ID'].isna()
+        if missing_subject.any():
+            print(f"Skipping {missing_subject.sum()} rows without 'Tank_number' or 'ID'")
+            df = df[~missing_subject]
+
+        df = df.drop(columns=['Day_number'], errors='ignore')
+        df = df.assign(Day=self.get_recording_days(df).to_numpy(), Tank_number=df['Tank_number'].astype('Int64'))
+        # Plain strings, so every file of the dataset has the same schema
+        text_columns = [column for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype) or df[column].dtype == object]
+        df = df.astype({column: 'string' for column in text_columns})
+
+        num_trials = 0
+        trial_key = ['Arena_ID', 'Trial_ID', 'Subject_ID', 'Start_time']
+        for key, trial_data in df.groupby(self.partition_columns + trial_key, sort=False, dropna=False, observed=True):
+            partition_path = self.get_partition_path(key[:len(self.partition_columns)])
+            os.makedirs(partition_path, exist_ok=True)
+            filename = quote('-'.join(str(value) for value in key[len(self.partition_columns):]), safe='') + '.parquet'
+
+            trial_data = trial_data.drop(columns=self.partition_columns).sort_values('Recording_time_s', kind='stable')
+            table = pa.Table.from_pandas(trial_data, preserve_index=False)
+            pq.write_table(table, os.path.join(partition_path, filename), row_group_size=self.row_group_size, write_statistics=True)
+            num_trials += 1
+        return num_trials
+
+    def get_subject_dataset(self, tank_number, id_val):
+        """
+        Returns the pyarrow dataset of the trials of one subject, so that only the
+        directory of the subject is listed.
+
+        Args:
+            tank_number (int): The 'Tank_number' value.
+            id_val (str): The 'ID' value.
+
+        Returns:
+            pyarrow.dataset.Dataset: The dataset, partitioned by 'Day', or None if the subject is not stored.
+        """
+        subject_path = self.get_partition_path([int(tank_number), id_val])
+        if not os.path.isdir(subject_path):
+            return None
+        partitioning = ds.partitioning(pa.schema([('Day', pa.string())]), flavor='hive')
+        return ds.dataset(subject_path, format='parquet', partitioning=partitioning)
+
+    def get_unique_subjects(self):
+        """
+        Retrieves the unique combinations of 'Tank_number' and 'ID' from the partition
+        directories, without reading any data.
+
+        Returns:
+            DataFrame: A DataFrame containing the unique combinations of 'Tank_number', and 'ID' values.
+        """
+        subjects = list()
+        for tank_dir in sorted(os.listdir(self.db_name)):
+            if not tank_dir.startswith('Tank_number='):
+                continue
+            for id_dir in sorted(os.listdir(os.path.join(self.db_name, tank_dir))):
+                if id_dir.startswith('ID='):
+                    subjects.append((int(unquote(tank_dir.split('=', 1)[1])), unquote(id_dir.split('=', 1)[1])))
+        return pd.DataFrame(subjects, columns=['Tank_number', 'ID'])
+
+    def get_data_for_subject(self, tank_number, id_val, columns = None, days = None, time_window = None):
+        """
+        Retrieves all data for a specific combination of 'Tank_number' and 'ID'.
+        Only the partition of the subject is read.
+
+        The optional arguments are pushed into the dataset scan: only the requested
+        columns are decoded, days are selected by their 'Day' partition directories
+        and the time window skips row groups by their 'Recording_time_s' statistics.
+
+        Args:
+            tank_number (int): The 'Tank_number' value.
+            id_val (str): The 'ID' value.
+            columns (list, optional): The columns to return, in this order. Defaults to None (all columns).
+            days (list, optional): The 'Day_number' values to return (1 for the first
+                                   recording day of the subject). Defaults to None (all days).
+            time_window (tuple, optional): The first and last 'Recording_time_s' in seconds
+                                           to return, inclusive. Defaults to None (whole trials).
+
+        Returns:
+            DataFrame: A DataFrame containing all data for the specified combination,
+                       sorted like EthoVisionSQLdataBase.get_data_for_subject.
+        """
+        dataset = self.get_subject_dataset(tank_number, id_val)
+        if dataset is None:
+            return pd.DataFrame(columns=columns)
+
+        filter_expression = None
+        if days is not None:
+            recording_days = self.get_subject_days(tank_number, id_val)
+            selected_days = [recording_days[day - 1] for day in days if 0 < day <= len(recording_days)]
+            filter_expression = ds.field('Day').isin(pa.array(selected_days, type=pa.string()))
+        if time_window is not None:
+            time_expression = (ds.field('Recording_time_s') >= time_window[0]) & (ds.field('Recording_time_s') <= time_window[1])
+            filter_expression = time_expression if filter_expression is None else filter_expression & time_expression
+
+        scan_columns = None
+        if columns is not None:
+            # The day and sort keys are read as well and dropped after sorting
+            scan_columns = [column for column in dict.fromkeys(list(columns) + ['Day', 'Start_time_epoch', 'Start_time', 'Recording_time_s'])
+                            if column in dataset.schema.names]
+
+        df = dataset.to_table(columns=scan_columns, filter=filter_expression).to_pandas()
+        df['Tank_number'] = int(tank_number)
+        df['ID'] = pd.Series(str(id_val), index=df.index, dtype='string')
+        df = self.prepare_subject_data(df, days=self.get_subject_days(tank_number, id_val))
+        if columns is not None:
+            df = df[list(columns)]
+        return df
+
+    def get_subject_days(self, tank_number, id_val):
+        """
+        Returns the recording dates of a subject from its 'Day' partition directories.
+
+        Args:
+            tank_number (int): The 'Tank_number' value.
+            id_val (str): The 'ID' value.
+
+        Returns:
+            list: The sorted dates as 'YYYY-MM-DD' strings, the first one is day 1.
+        """
+        subject_path = self.get_partition_path([int(tank_number), id_val])
+        return sorted(unquote(day_dir.split('=', 1)[1]) for day_dir in os.listdir(subject_path) if day_dir.startswith('Day='))
+
+    def iter_subjects(self):
+        """
+        Yields the data of every subject, one partition at a time.
+
+        Yields:
+            tuple: The 'Tank_number' value, the 'ID' value and the DataFrame of the subject.
+        """
+        for tank_number, id_val in self.get_unique_subjects().itertuples(index=False):
+            yield tank_number, id_val, self.get_data_for_subject(tank_number, id_val)
+
+    def prepare_subject_data(self, df, days = None):
+        """
+        Adds the 'Day_number' of the subject (1 for the first recording date) in place
+        of the 'Day' partition key and sorts by start time and recording time.
+
+        Args:
+            df (DataFrame): The rows of one subject.
+            days (list, optional): All recording dates of the subject, needed when df
+                                   holds only some of them. Defaults to None (the dates in df).
+
+        Returns:
+            DataFrame: The sorted DataFrame.
+        """
+        day_values = df.pop('Day').to_numpy(dtype=object)
+        days = np.unique(day_values) if days is None else np.asarray(days, dtype=object)
+        df['Day_number'] = np.searchsorted(days, day_values) + 1
+        sort_columns = ['Start_time_epoch', 'Recording_time_s'] if 'Start_time_epoch' in df.columns else ['Start_time', 'Recording_time_s']
+        return df.sort_values(by=sort_columns, kind='stable', ignore_index=True)
+
+    def close_connection(self):
+        # Nothing is held open between queries
+        pass
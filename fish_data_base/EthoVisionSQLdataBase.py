@@ -1,12 +1,447 @@
 import pandas as pd
 import sqlite3
+from contextlib import contextmanager
+from fish_data_base.EthoVisionConnectionPool import EthoVisionConnectionPool
+
+
+# Index name -> indexed columns of the 'ethovision_data' table
+ETHOVISION_DATA_INDEXES = {
+    # per-subject queries, in the order they are returned
+    'ethovision_data_subject_epoch': ['Tank_number', 'ID', 'Start_time_epoch', 'Recording_time_s'],
+    # narrow covering index for listing the subjects
+    'ethovision_data_subjects': ['Tank_number', 'ID'],
+}
+# Indexes of earlier versions that are replaced by ETHOVISION_DATA_INDEXES
+OBSOLETE_INDEXES = ['ethovision_data_subject_time']
+
+# 'Start_time' ('04/28/2023 10:00:00.000') in epoch seconds, with the local time
+# treated as UTC like EthoVisionReader.get_start_time_epoch
+START_TIME_EPOCH_SQL = """CAST(strftime('%s', substr(Start_time, 7, 4) || '-' || substr(Start_time, 1, 2) || '-' ||
+substr(Start_time, 4, 2) || ' ' || substr(Start_time, 12)) AS INTEGER)"""
+
+def is_numeric_column_type(column_type):
+    """
+    Checks whether a declared SQLite column type has numeric affinity. Databases
+    ingested before the typed schema declare every column as TEXT.
+
+    Args:
+        column_type (str): The declared type, as returned by PRAGMA table_info.
+
+    Returns:
+        bool: True for INTEGER, REAL and NUMERIC affinity.
+    """
+    column_type = column_type.upper()
+    return column_type != '' and not any(name in column_type for name in ('CHAR', 'CLOB', 'TEXT', 'BLOB'))
+
+def get_recording_time_sql(table_columns):
+    """
+    Returns the SQL expression of 'Recording_time_s' that sorts numerically. TEXT
+    columns of older databases would sort '10.0' before '2.0', so they are cast.
+
+    Args:
+        table_columns (dict): Maps the columns of the 'ethovision_data' table to their declared types.
+
+    Returns:
+        str: The column name or the cast expression.
+    """
+    if is_numeric_column_type(table_columns.get('Recording_time_s', '')):
+        return 'Recording_time_s'
+    return 'CAST(Recording_time_s AS REAL)'
+
+def get_table_columns(db_connection):
+    """
+    Returns the columns of the 'ethovision_data' table or view.
+
+    Args:
+        db_connection (sqlite3.Connection): A SQLite database connection.
+
+    Returns:
+        dict: Maps the column names to their declared types, in table order.
+    """
+    return {row[1]: row[2] for row in db_connection.execute('PRAGMA table_info(ethovision_data);')}
+
+def add_start_time_epochs(db_connection):
+    """
+    Fills the 'Start_time_epoch' column of rows ingested before it existed, parsing
+    their 'Start_time' strings in SQL. The column is added if it is missing.
+
+    Args:
+        db_connection (sqlite3.Connection): A SQLite database connection.
+
+    Returns:
+        int: The number of rows that were updated.
+    """
+    columns = [row[1] for row in db_connection.execute('PRAGMA table_info(ethovision_data);')]
+    with db_connection:
+        if 'Start_time_epoch' not in columns:
+            db_connection.execute('ALTER TABLE ethovision_data ADD COLUMN Start_time_epoch INTEGER;')
+        cursor = db_connection.execute(f"""
+        UPDATE ethovision_data SET Start_time_epoch = {START_TIME_EPOCH_SQL}
+        WHERE Start_time_epoch IS NULL AND Start_time IS NOT NULL;
+        """)
+    return cursor.rowcount
+
+def create_ethovision_indexes(db_connection):
+    """
+    Creates the indexes of ETHOVISION_DATA_INDEXES on the 'ethovision_data' table
+    if they do not exist yet. SQLite keeps them up to date on every later write, so
+    this only needs to run once per database, ideally after the bulk ingest.
+
+    Indexes of earlier versions, and indexes whose columns differ from the current
+    definition, are dropped. Before the start time index is built the missing
+    'Start_time_epoch' values are filled in (add_start_time_epochs). A TEXT
+    'Recording_time_s' column is indexed as a number (get_recording_time_sql).
+
+    Args:
+        db_connection (sqlite3.Connection): A SQLite database connection.
+
+    Returns:
+        list: The names of the indexes that were created.
+    """
+    table_exists = db_connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ethovision_data';").fetchone()
+    if table_exists is None:
+        return []
+
+    existing_indexes = {row[0] for row in db_connection.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'ethovision_data';")}
+    for index_name in existing_indexes.intersection(OBSOLETE_INDEXES):
+        db_connection.execute(f'DROP INDEX {index_name};')
+
+    recording_time_sql = get_recording_time_sql(get_table_columns(db_connection))
+    created_indexes = []
+    for index_name, columns in ETHOVISION_DATA_INDEXES.items():
+        # Expression columns are listed without a name by index_xinfo
+        index_columns = [None if column == 'Recording_time_s' and recording_time_sql != column else column for column in columns]
+        if index_name in existing_indexes:
+            existing_columns = [row[2] for row in db_connection.execute(f'PRAGMA index_xinfo({index_name});') if row[5]]
+            if existing_columns == index_columns:
+                continue
+            db_connection.execute(f'DROP INDEX {index_name};')
+        if 'Start_time_epoch' in columns:
+            add_start_time_epochs(db_connection)
+        column_str = ', '.join(f'"{column}"' if column is not None else recording_time_sql for column in index_columns)
+        db_connection.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON ethovision_data ({column_str});')
+        created_indexes.append(index_name)
+    if created_indexes:
+        # Let the query planner know the index statistics
+        db_connection.execute('ANALYZE ethovision_data;')
+    db_connection.commit()
+    return created_indexes
+
+def update_day_numbers(db_connection, subjects = None):
+    """
+    Stores the per-subject 'Day_number' in the 'ethovision_data' table, computed from the
+    integer 'Start_time_epoch' column: the earliest recording day of each
+    (Tank_number, ID) pair is day 1. Only the given subjects are recomputed, through
+    the subject index, and only rows whose day number changed are rewritten, so
+    calling this after every ingest is cheap. Tables ingested without
+    'Start_time_epoch' are left unchanged.
+
+    Args:
+        db_connection (sqlite3.Connection): A SQLite database connection.
+        subjects (iterable, optional): The (Tank_number, ID) pairs to update, e.g. those
+                                       just written. Defaults to None (all subjects).
+
+    Returns:
+        None
+    """
+    normalized = is_normalized(db_connection)
+    if not normalized:
+        columns = [row[1] for row in db_connection.execute('PRAGMA table_info(ethovision_data);')]
+        if 'Start_time_epoch' not in columns:
+            return
+        if 'Day_number' not in columns:
+            db_connection.execute('ALTER TABLE ethovision_data ADD COLUMN Day_number INTEGER;')
+
+    subject_condition = ''
+    if subjects is not None:
+        subjects = {tuple(get_sql_value(value) for value in subject) for subject in subjects}
+        if not subjects:
+            db_connection.commit()
+            return
+        # Copies the column affinities, so the keys compare like the stored ones
+        subject_table = 'subjects' if normalized else 'ethovision_data'
+        db_connection.execute('DROP TABLE IF EXISTS temp.written_subjects;')
+        db_connection.execute(f'CREATE TEMP TABLE written_subjects AS SELECT Tank_number, "ID" FROM main.{subject_table} WHERE 0;')
+        db_connection.executemany('INSERT INTO temp.written_subjects VALUES (?, ?);', subjects)
+        subject_condition = 'AND (Tank_number, "ID") IN (SELECT Tank_number, "ID" FROM temp.written_subjects)'
+
+    with db_connection:
+        if normalized:
+            # The day numbers are stored once per trial
+            if subject_condition:
+                subject_condition = f'AND subject_key IN (SELECT subject_key FROM subjects WHERE 1 {subject_condition})'
+            db_connection.execute('DROP TABLE IF EXISTS temp.trial_days;')
+            db_connection.execute(f"""
+            CREATE TEMP TABLE trial_days AS
+            SELECT trial_key, DENSE_RANK() OVER (PARTITION BY subject_key ORDER BY Start_time_epoch / 86400) AS Day_number
+            FROM trials WHERE Start_time_epoch IS NOT NULL {subject_condition};
+            """)
+            db_connection.execute('CREATE UNIQUE INDEX temp.trial_days_key ON trial_days (trial_key);')
+            day_query = '(SELECT d.Day_number FROM trial_days d WHERE d.trial_key = trials.trial_key)'
+            db_connection.execute(f'UPDATE trials SET Day_number = {day_query} WHERE Start_time_epoch IS NOT NULL {subject_condition} AND Day_number IS NOT {day_query};')
+            db_connection.execute('DROP TABLE temp.trial_days;')
+        else:
+            day_query = """
+            (SELECT d.Day_number FROM subject_days d
+             WHERE d.Tank_number = ethovision_data.Tank_number AND d.ID = ethovision_data.ID
+               AND d.day = ethovision_data.Start_time_epoch / 86400)
+            """
+            db_connection.execute('DROP TABLE IF EXISTS temp.subject_days;')
+            db_connection.execute(f"""
+            CREATE TEMP TABLE subject_days AS
+            SELECT Tank_number, ID, day, DENSE_RANK() OVER (PARTITION BY Tank_number, ID ORDER BY day) AS Day_number
+            FROM (SELECT DISTINCT Tank_number, ID, Start_time_epoch / 86400 AS day
+                  FROM ethovision_data WHERE Start_time_epoch IS NOT NULL {subject_condition});
+            """)
+            db_connection.execute('CREATE INDEX temp.subject_days_key ON subject_days (Tank_number, ID, day);')
+            db_connection.execute(f'UPDATE ethovision_data SET Day_number = {day_query} WHERE Start_time_epoch IS NOT NULL {subject_condition} AND Day_number IS NOT {day_query};')
+            db_connection.execute('DROP TABLE temp.subject_days;')
+        db_connection.execute('DROP TABLE IF EXISTS temp.written_subjects;')
+
+
+# Columns of the normalized layout, see create_normalized_schema
+SUBJECT_COLUMNS = ['Tank_number', 'ID', 'Sex']
+TRIAL_COLUMNS = ['Start_time', 'Arena_ID', 'Trial_ID', 'Subject_ID', 'Start_time_epoch', 'Day_number']
+TRIAL_KEY = ['Arena_ID', 'Trial_ID', 'Subject_ID', 'Start_time']
+
+def get_sql_value(value):
+    """
+    Converts a pandas / numpy scalar into a value the sqlite3 module can bind.
+
+    Args:
+        value: The scalar.
+
+    Returns:
+        The value as a Python scalar, None for missing values.
+    """
+    if value is None or pd.isna(value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+def is_normalized(db_connection):
+    """
+    Checks whether the database uses the normalized layout, where 'ethovision_data'
+    is a view over the 'subjects', 'trials' and 'samples' tables.
+
+    Args:
+        db_connection (sqlite3.Connection): A SQLite database connection.
+
+    Returns:
+        bool: True for the normalized layout.
+    """
+    row = db_connection.execute("SELECT type FROM sqlite_master WHERE name = 'ethovision_data';").fetchone()
+    return row is not None and row[0] == 'view'
+
+def create_normalized_schema(db_connection):
+    """
+    Creates the normalized storage layout:
+
+    - 'subjects': one row per fish (Tank_number, ID, Sex),
+    - 'trials': one row per track with its metadata and the key of its subject,
+    - 'samples': the numeric trajectory columns, keyed by the trial.
+
+    The metadata strings are thus stored once per trial instead of once per sample.
+    The 'ethovision_data' view joins the three tables back into the wide layout, so
+    every query written for the wide table keeps working. The sample columns are
+    added by write_normalized_data as they appear.
+
+    Args:
+        db_connection (sqlite3.Connection): A SQLite database connection.
+
+    Returns:
+        None
+    """
+    db_connection.execute("""
+    CREATE TABLE IF NOT EXISTS subjects (
+        subject_key INTEGER PRIMARY KEY,
+        Tank_number INTEGER,
+        ID TEXT,
+        Sex TEXT
+    );
+    """)
+    db_connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS subjects_key ON subjects (Tank_number, ID);')
+    db_connection.execute("""
+    CREATE TABLE IF NOT EXISTS trials (
+        trial_key INTEGER PRIMARY KEY,
+        subject_key INTEGER NOT NULL REFERENCES subjects (subject_key),
+        Start_time TEXT,
+        Arena_ID INTEGER,
+        Trial_ID TEXT,
+        Subject_ID TEXT,
+        Start_time_epoch INTEGER,
+        Day_number INTEGER
+    );
+    """)
+    db_connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS trials_key ON trials (Arena_ID, Trial_ID, Subject_ID, Start_time);')
+    db_connection.execute('CREATE INDEX IF NOT EXISTS trials_subject ON trials (subject_key, Start_time_epoch);')
+    db_connection.execute('CREATE TABLE IF NOT EXISTS samples (trial_key INTEGER NOT NULL REFERENCES trials (trial_key));')
+    db_connection.execute('CREATE INDEX IF NOT EXISTS samples_trial ON samples (trial_key);')
+    create_ethovision_data_view(db_connection)
+    db_connection.commit()
+
+def get_normalized_column_str(db_connection):
+    """
+    Returns the select list that joins the normalized tables into the columns of
+    the wide table, for tables aliased sa (samples), t (trials) and su (subjects).
+
+    Args:
+        db_connection (sqlite3.Connection): A SQLite database connection.
+
+    Returns:
+        str: The comma separated column list.
+    """
+    sample_columns = [row[1] for row in db_connection.execute('PRAGMA table_info(samples);') if row[1] != 'trial_key']
+    return ', '.join([f'sa."{column}"' for column in sample_columns] +
+                     [f'su."{column}"' for column in ['Tank_number', 'Sex', 'ID']] +
+                     [f't."{column}"' for column in TRIAL_COLUMNS])
+
+def create_ethovision_data_view(db_connection):
+    """
+    (Re)creates the 'ethovision_data' view of the normalized layout, with the
+    columns in the order of the wide table.
+
+    Args:
+        db_connection (sqlite3.Connection): A SQLite database connection.
+
+    Returns:
+        None
+    """
+    db_connection.execute('DROP VIEW IF EXISTS ethovision_data;')
+    db_connection.execute(f"""
+    CREATE VIEW ethovision_data AS
+    SELECT {get_normalized_column_str(db_connection)}
+    FROM samples sa
+    JOIN trials t ON t.trial_key = sa.trial_key
+    JOIN subjects su ON su.subject_key = t.subject_key;
+    """)
+
+def get_subject_key(db_connection, subject):
+    """
+    Returns the key of a subject of the normalized layout, adding the subject if it is new.
+
+    Args:
+        db_connection (sqlite3.Connection): A SQLite database connection.
+        subject (tuple): The Tank_number, ID and Sex of the subject.
+
+    Returns:
+        int: The subject key.
+    """
+    row = db_connection.execute('SELECT subject_key FROM subjects WHERE Tank_number IS ? AND "ID" IS ?;', subject[:2]).fetchone()
+    if row is not None:
+        return row[0]
+    return db_connection.execute('INSERT INTO subjects (Tank_number, "ID", Sex) VALUES (?, ?, ?);', subject).lastrowid
+
+def write_normalized_data(file_data, db_connection, if_trial_exists = None):
+    """
+    Writes the data returned by an EthoVision reader to the normalized layout.
+
+    Each trial, keyed on (Arena_ID, Trial_ID, Subject_ID, Start_time), is written
+    in its own transaction. Its subject and trial rows are added if they are new,
+    and its samples are appended (None), replace the stored samples ('replace') or
+    are not written if the trial is already stored ('skip').
+
+    Args:
+        file_data (DataFrame): The trajectory data with metadata of one or more trials.
+        db_connection (sqlite3.Connection): A SQLite database connection.
+        if_trial_exists (str, optional): None to append, 'replace' or 'skip'. Defaults to None.
+
+    Returns:
+        None
+    """
+    if if_trial_exists not in (None, 'replace', 'skip'):
+        raise ValueError(f"if_trial_exists must be None, 'replace' or 'skip', not {if_trial_exists!r}")
+
+    sample_columns = [column for column in file_data.columns if column not in SUBJECT_COLUMNS + TRIAL_COLUMNS]
+    stored_columns = {row[1] for row in db_connection.execute('PRAGMA table_info(samples);')}
+    new_columns = [column for column in sample_columns if column not in stored_columns]
+    if new_columns:
+        for column in new_columns:
+            db_connection.execute(f'ALTER TABLE samples ADD COLUMN "{column}" REAL;')
+        create_ethovision_data_view(db_connection)
+        db_connection.commit()
+
+    key_condition = ' AND '.join(f'"{column}" IS ?' for column in TRIAL_KEY)
+    trial_column_str = ', '.join(f'"{column}"' for column in TRIAL_COLUMNS)
+    sample_column_str = ', '.join(f'"{column}"' for column in sample_columns)
+    insert_query = f'INSERT INTO samples (trial_key, {sample_column_str}) VALUES ({", ".join("?" * (len(sample_columns) + 1))});'
+
+    for key, trial_data in file_data.groupby(TRIAL_KEY, sort=False, dropna=False, observed=True):
+        key = tuple(get_sql_value(value) for value in key)
+        first_row = trial_data.iloc[0]
+        subject = tuple(get_sql_value(first_row.get(column)) for column in SUBJECT_COLUMNS)
+        trial = tuple(get_sql_value(first_row.get(column)) for column in TRIAL_COLUMNS)
+        samples = trial_data[sample_columns].astype(object).where(trial_data[sample_columns].notna(), None)
+
+        with db_connection:
+            row = db_connection.execute(f'SELECT trial_key FROM trials WHERE {key_condition};', key).fetchone()
+            if row is None:
+                subject_key = get_subject_key(db_connection, subject)
+                trial_key = db_connection.execute(
+                    f'INSERT INTO trials (subject_key, {trial_column_str}) VALUES ({", ".join("?" * (len(TRIAL_COLUMNS) + 1))});',
+                    (subject_key,) + trial).lastrowid
+            elif if_trial_exists == 'skip':
+                continue
+            else:
+                trial_key = row[0]
+                if if_trial_exists == 'replace':
+                    db_connection.execute('DELETE FROM samples WHERE trial_key = ?;', (trial_key,))
+
+            db_connection.executemany(insert_query, ((trial_key,) + sample for sample in samples.itertuples(index=False, name=None)))
 
 
 class EthoVisionSQLdataBase:
-    def __init__(self, db_name):
+    def __init__(self, db_name, create_indexes = False, pool_size = None):
+        """
+        Opens the database.
+
+        Args:
+            db_name (str): The path of the SQLite database.
+            create_indexes (bool, optional): If True, missing subject indexes are created. Defaults to False.
+            pool_size (int, optional): If set, the database is read through a pool of this many
+                read-only connections (see EthoVisionConnectionPool), and the object can be used
+                from several threads and processes at once. Defaults to None (one connection).
+        """
         self.db_name = db_name
         self.db_connection = self.open_database()
-        
+        if create_indexes and self.db_connection:
+            self.create_indexes()
+
+        self.pool = None
+        if pool_size is not None and self.db_connection:
+            self.db_connection.close()
+            self.db_connection = None
+            self.pool = EthoVisionConnectionPool(db_name, pool_size)
+
+    def __getstate__(self):
+        # Only the pooled mode can be sent to other processes
+        if self.pool is None:
+            raise TypeError('EthoVisionSQLdataBase can only be pickled in pooled mode (pool_size=...)')
+        return self.__dict__.copy()
+
+    def is_open(self):
+        """
+        Checks whether the database could be opened.
+
+        Returns:
+            bool: True if queries can be run.
+        """
+        return self.pool is not None or self.db_connection is not None
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that provides the connection to run a query on: a connection
+        checked out of the pool in pooled mode, the connection of this object otherwise.
+
+        Yields:
+            sqlite3.Connection: The connection.
+        """
+        if self.pool is None:
+            yield self.db_connection
+        else:
+            with self.pool.connection() as db_connection:
+                yield db_connection
+
     def open_database(self):
         """
         Opens an existing SQLite database with the specified name.
@@ -21,6 +456,16 @@ class EthoVisionSQLdataBase:
             print(f"Error opening the database: {e}")
             return None
 
+    def create_indexes(self):
+        """
+        Creates the subject indexes of the 'ethovision_data' table if they are missing,
+        see create_ethovision_indexes. Without them every subject query scans the whole table.
+
+        Returns:
+            list: The names of the indexes that were created.
+        """
+        return create_ethovision_indexes(self.db_connection)
+
     def get_unique_subjects(self):
         """
         Retrieves the unique combinations of values in the columns 'Tank_number' and 'Subject ID'
@@ -33,55 +478,223 @@ class EthoVisionSQLdataBase:
         SELECT DISTINCT Tank_number, "ID"
         FROM ethovision_data;
         """
+        with self.connection() as db_connection:
+            if is_normalized(db_connection):
+                # one row per subject, no need to scan the samples
+                query = """
+                SELECT Tank_number, "ID"
+                FROM subjects
+                WHERE subject_key IN (SELECT subject_key FROM trials);
+                """
 
-        unique_combinations = pd.read_sql_query(query, self.db_connection)
+            unique_combinations = pd.read_sql_query(query, db_connection)
 
         return unique_combinations
 
-    def get_data_for_subject(self, tank_number, id_val):
+    def get_data_for_subject(self, tank_number, id_val, columns = None, days = None, time_window = None):
         """
         Retrieves all data for a specific combination of 'Tank_number' and 'ID'
         from the SQLite database.
 
+        The optional arguments are translated into the SELECT list and WHERE clause
+        of the query, so only the requested columns and rows are read from the database.
+        The rows are returned ordered by 'Start_time_epoch' and 'Recording_time_s',
+        which the subject index serves without sorting (see get_order_str).
+
         Args:
             tank_number (str): The 'Tank_number' value.
             id_val (str): The 'ID' value.
+            columns (list, optional): The columns to return, in this order. Defaults to None (all columns).
+            days (list, optional): The 'Day_number' values to return (1 for the first
+                                   recording day of the subject). Databases without the
+                                   'Day_number' column get it computed for the returned
+                                   rows (see get_day_condition). Defaults to None (all days).
+            time_window (tuple, optional): The first and last 'Recording_time_s' in seconds
+                                           to return, inclusive. Defaults to None (whole trials).
 
         Returns:
-            DataFrame: A DataFrame containing all data for the specified combination.
+            DataFrame: A DataFrame containing all data for the specified combination,
+                       in recording order.
         """
+        # numpy scalars, e.g. from get_unique_subjects, would be bound as BLOBs and match nothing
+        tank_number, id_val = get_sql_value(tank_number), get_sql_value(id_val)
+        conditions = ['Tank_number = ?', '"ID" = ?']
+        params = [tank_number, id_val]
+
+        with self.connection() as db_connection:
+            table_columns = get_table_columns(db_connection)
+
+            day_numbers = None
+            if days is not None:
+                day_condition, day_params, day_numbers = self.get_day_condition(db_connection, tank_number, id_val, days, table_columns)
+                conditions.append(day_condition)
+                params += day_params
+            if time_window is not None:
+                # A TEXT column would be compared as strings
+                conditions.append(f'{get_recording_time_sql(table_columns)} BETWEEN ? AND ?')
+                params += [get_sql_value(value) for value in time_window]
+
+            available_columns = list(table_columns)
+            if day_numbers is not None:
+                available_columns.append('Day_number')
+            if columns is None:
+                columns = available_columns
+            # SQLite would read an unknown quoted column name as a string literal
+            unknown_columns = [column for column in columns if column not in available_columns]
+            if unknown_columns:
+                raise ValueError(f'Unknown columns: {", ".join(unknown_columns)}')
+
+            column_terms = []
+            select_params = []
+            for column in columns:
+                if column == 'Day_number' and day_numbers is not None:
+                    # The day numbers computed by get_day_condition, by start time
+                    cases = ' '.join(['WHEN ? THEN ?'] * len(day_numbers))
+                    column_terms.append(f'CASE Start_time {cases} END AS Day_number' if day_numbers else 'NULL AS Day_number')
+                    select_params += [value for item in day_numbers.items() for value in item]
+                else:
+                    column_terms.append(f'"{column}"')
+            column_str = ', '.join(column_terms)
+            query = f"""
+            SELECT {column_str}
+            FROM ethovision_data
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {self.get_order_str(table_columns)};
+            """
+            data_for_combination = pd.read_sql_query(query, db_connection, params=select_params + params)
+
+        return self.prepare_subject_data(data_for_combination)
+
+    def get_order_str(self, table_columns):
+        """
+        Returns the ORDER BY terms that put the rows of a subject in recording order.
+
+        Databases with the integer 'Start_time_epoch' column are ordered on it, which
+        the 'ethovision_data_subject_epoch' index serves. Older databases have their
+        'Start_time' strings converted in SQL; run create_indexes (or the
+        sql_create_indexes script) once to store the epochs and index them. A TEXT
+        'Recording_time_s' column is ordered as a number.
+
+        Args:
+            table_columns (dict): Maps the columns of the 'ethovision_data' table to their declared types.
+
+        Returns:
+            str: The comma separated ORDER BY terms.
+        """
+        recording_time_sql = get_recording_time_sql(table_columns)
+        if 'Start_time_epoch' in table_columns:
+            return f'Start_time_epoch, {recording_time_sql}'
+        return f'{START_TIME_EPOCH_SQL}, {recording_time_sql}'
+
+    def get_day_condition(self, db_connection, tank_number, id_val, days, table_columns):
+        """
+        Returns the WHERE condition selecting the given recording days of a subject.
+
+        Databases with the 'Day_number' column are filtered on it directly. For older
+        databases the start times of the subject are read (from the subject index)
+        and numbered by date like EthoVisionDataProcessor.add_day_number, and the rows
+        are filtered on the start times of the requested days. The day numbers of these
+        start times are returned too, so that the rows keep their day numbers.
+
+        Args:
+            db_connection (sqlite3.Connection): The connection to run the query on.
+            tank_number (str): The 'Tank_number' value.
+            id_val (str): The 'ID' value.
+            days (list): The 'Day_number' values to select.
+            table_columns (dict): Maps the columns of the 'ethovision_data' table to their declared types.
+
+        Returns:
+            tuple: The condition string, the list of its parameters and a dictionary mapping
+                   the selected start times to their day numbers (None if the table has the
+                   'Day_number' column).
+        """
+        days = [int(day) for day in days]
+        if 'Day_number' in table_columns:
+            return f'Day_number IN ({", ".join("?" * len(days))})', days, None
+
         query = """
-        SELECT *
+        SELECT DISTINCT Start_time
         FROM ethovision_data
         WHERE Tank_number = ?  AND "ID" = ?;
         """
+        start_times = pd.read_sql_query(query, db_connection, params=(tank_number, id_val))['Start_time']
+        dates = pd.to_datetime(start_times, format='%m/%d/%Y %H:%M:%S.%f', errors='coerce').dt.normalize()
+        day_numbers = dates.rank(method='dense')
+        is_selected = day_numbers.isin(days)
+        selected = start_times[is_selected].tolist()
+        selected_days = dict(zip(selected, day_numbers[is_selected].astype(int).tolist()))
+        return f'Start_time IN ({", ".join("?" * len(selected))})', selected, selected_days
 
-        data_for_combination = pd.read_sql_query(query, self.db_connection, params=(tank_number, id_val))
-        data_for_combination.X_center_cm = pd.to_numeric(data_for_combination.X_center_cm, errors='coerce')
-        data_for_combination.Y_center_cm = pd.to_numeric(data_for_combination.Y_center_cm, errors='coerce')
+    def iter_subjects(self, chunksize = 100000):
+        """
+        Yields the data of every subject, read from the database in one ordered pass.
 
-        return self.sort_dataframe(data_for_combination)
+        The rows are read ordered by (Tank_number, ID, Start_time_epoch, Recording_time_s),
+        which the subject index serves without sorting (the normalized layout only
+        sorts the samples of each trial). They are fetched in chunks, and each subject is yielded as soon as the first row of the next subject has been
+        read. This replaces get_unique_subjects followed by one get_data_for_subject
+        query per subject with a single sequential read.
 
-    def sort_dataframe(self, df):
+        Args:
+            chunksize (int, optional): The number of rows fetched at a time. Defaults to 100000.
+
+        Yields:
+            tuple: The 'Tank_number' value, the 'ID' value and the DataFrame of the subject,
+                   as returned by get_data_for_subject.
+        """
+        with self.connection() as db_connection:
+            table_columns = get_table_columns(db_connection)
+            query = f"""
+            SELECT *
+            FROM ethovision_data
+            ORDER BY Tank_number, "ID", {self.get_order_str(table_columns)};
+            """
+            if is_normalized(db_connection):
+                # Walk subjects -> trials -> samples along their indexes, which keeps the
+                # rows in order without sorting the whole table
+                query = f"""
+                SELECT {get_normalized_column_str(db_connection)}
+                FROM subjects su CROSS JOIN trials t CROSS JOIN samples sa
+                WHERE t.subject_key = su.subject_key AND sa.trial_key = t.trial_key
+                ORDER BY su.Tank_number, su."ID", t.Start_time_epoch, sa.Recording_time_s;
+                """
+
+            subject_key, subject_chunks = None, list()
+            for chunk in pd.read_sql_query(query, db_connection, chunksize=chunksize):
+                # The rows are ordered, so every group is one contiguous block of the chunk
+                for key, subject_chunk in chunk.groupby(['Tank_number', 'ID'], sort=False, dropna=False):
+                    key = tuple(get_sql_value(value) for value in key)
+                    if subject_chunks and key != subject_key:
+                        yield subject_key + (self.prepare_subject_data(pd.concat(subject_chunks, ignore_index=True)),)
+                        subject_chunks = list()
+                    subject_key = key
+                    subject_chunks.append(subject_chunk)
+
+        if subject_chunks:
+            yield subject_key + (self.prepare_subject_data(pd.concat(subject_chunks, ignore_index=True)),)
+
+    def prepare_subject_data(self, df):
         """
-        Sorts the input DataFrame first by the 'Start_time' column and then by the 'Recording_time' column.
+        Converts the columns of a subject DataFrame read from the database to their
+        types. The rows are already in recording order, see get_order_str.
 
         Args:
-            df (DataFrame): A DataFrame with 'Start_time' and 'Recording_time' columns.
+            df (DataFrame): The rows of one subject.
 
         Returns:
-            DataFrame: The sorted DataFrame.
+            DataFrame: The typed DataFrame.
         """
-        # Convert 'Start_time' and 'Recording_time' columns to datetime format, if not already in that format
-        df['Start_time'] = pd.to_datetime(df['Start_time'], errors='ignore')
-
-        # Sort DataFrame by 'Start_time' and 'Recording_time' columns
-        sorted_df = df.sort_values(by=['Start_time', 'Recording_time_s'])
+        # Databases ingested before the typed schema store times and coordinates as TEXT
+        for column in ['Trial_time_s', 'Recording_time_s', 'X_center_cm', 'Y_center_cm']:
+            if column in df.columns and not pd.api.types.is_numeric_dtype(df[column]):
+                df[column] = pd.to_numeric(df[column], errors='coerce')
+        if 'Start_time_epoch' in df.columns:
+            df['Start_time_epoch'] = df['Start_time_epoch'].astype('Int64')
 
-        # Reset the index of the sorted DataFrame
-        sorted_df.reset_index(drop=True, inplace=True)
+        return df.reset_index(drop=True)
 
-        return sorted_df
-    
     def close_connection(self):
-        self.db_connection.close()
+        if self.pool is not None:
+            self.pool.close()
+        if self.db_connection is not None:
+            self.db_connection.close()
@@ -22,6 +22,10 @@ parent_directory = '/home/bgeurten/ethoVision_database/'
 # Compile data daywise
 etho_vision_analysis = EthoVisionExperimentSeries(tag, parent_directory)
 etho_vision_analysis.process_and_save()
+# New recordings can be analysed straight from the EthoVision exports, skipping the database:
+# from run_scripts.run_ethoTrackReader import get_all_ethovision_files, make_ethovision_reader
+# etho_vision_analysis = EthoVisionExperimentSeries(tag, parent_directory, use_database=False)
+# etho_vision_analysis.process_and_save([make_ethovision_reader(file, streaming_mode=True) for file in get_all_ethovision_files(raw_folder)])
 #%%
 db_position = f'{parent_directory}{tag}_daywise_analysis.csv'
 df = pd.read_csv(db_position)
@@ -1,8 +1,15 @@
 import pandas as pd
 from data_handlers.EthoVisionReader import EthoVisionReader
+from data_handlers.EthoVisionTextReader import EthoVisionTextReader
+from data_handlers.EthoVisionArrowReader import EthoVisionArrowReader
+from data_handlers.EthoVisionTankCalibration import EthoVisionTankCalibration
+from fish_data_base.EthoVisionSQLdataBase import create_ethovision_indexes, create_normalized_schema, is_normalized, update_day_numbers, write_normalized_data
 import sqlite3
 import os
+import hashlib
+from datetime import datetime
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm
 
 def get_all_xlsx_files(folder):
@@ -22,6 +29,295 @@ def get_all_xlsx_files(folder):
                 xlsx_files.append(os.path.join(root, file))
     return xlsx_files
 
+def get_all_ethovision_files(folder, extensions = ('.xlsx', '.txt')):
+    """
+    Searches for all EthoVision exports (Excel workbooks and raw data text exports)
+    in the given folder and its subdirectories.
+
+    Args:
+        folder (str): The path to the folder to search.
+        extensions (tuple, optional): The file extensions to accept. Defaults to ('.xlsx', '.txt').
+
+    Returns:
+        list: A list of file paths found in the folder and its subdirectories.
+    """
+    ethovision_files = []
+    for root, dirs, files in os.walk(folder):
+        for file in files:
+            if file.endswith(extensions):
+                ethovision_files.append(os.path.join(root, file))
+    return ethovision_files
+
+def make_ethovision_reader(file, **kwargs):
+    """
+    Creates the reader matching the file type: EthoVisionTextReader for text
+    exports (.txt, .csv), EthoVisionArrowReader for Arrow archives (.feather),
+    EthoVisionReader for Excel workbooks.
+
+    Args:
+        file (str): The path of the EthoVision export.
+        **kwargs: Passed on to the reader.
+
+    Returns:
+        EthoVisionReader: The reader for the file.
+    """
+    if file.endswith(('.txt', '.csv')):
+        return EthoVisionTextReader(file, **kwargs)
+    if file.endswith('.feather'):
+        return EthoVisionArrowReader(file, **kwargs)
+    return EthoVisionReader(file, **kwargs)
+
+def create_ingest_manifest(db_connection):
+    """
+    Creates the 'ingest_manifest' table, which records every workbook that has been
+    written to 'ethovision_data', if it does not exist yet.
+
+    Args:
+        db_connection (sqlite3.Connection): A SQLite database connection.
+
+    Returns:
+        None
+    """
+    db_connection.execute("""
+    CREATE TABLE IF NOT EXISTS ingest_manifest (
+        file_path TEXT PRIMARY KEY,
+        file_size INTEGER,
+        mtime REAL,
+        content_hash TEXT,
+        ingested_at TEXT
+    );
+    """)
+    db_connection.execute('CREATE INDEX IF NOT EXISTS ingest_manifest_hash ON ingest_manifest (content_hash);')
+    db_connection.commit()
+
+def compute_file_hash(file, chunk_size = 1 << 20):
+    """
+    Computes the SHA-256 hash of a file's content, reading it in chunks.
+
+    Args:
+        file (str): The path of the file.
+        chunk_size (int, optional): The number of bytes read at a time. Defaults to 1 MiB.
+
+    Returns:
+        str: The hexadecimal SHA-256 digest.
+    """
+    file_hash = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def get_changed_files(xlsx_files, db_connection):
+    """
+    Filters the given list down to the workbooks that are not yet recorded in the
+    'ingest_manifest' table with the same content.
+
+    A file whose path, size and modification time match its manifest entry is skipped
+    without being read. Otherwise its content hash is computed, and the file is still
+    skipped if that content has been ingested before (e.g. a touched or copied file),
+    or if it is a copy of another file in the list. Such copies are recorded by the
+    next run, once the content they share has been ingested.
+
+    Args:
+        xlsx_files (list): A list of .xlsx file paths.
+        db_connection (sqlite3.Connection): A SQLite database connection.
+
+    Returns:
+        dict: Maps the .xlsx file paths that are new or have been modified to their
+              content hashes, to be passed on to update_ingest_manifest.
+    """
+    create_ingest_manifest(db_connection)
+    manifest = {row[0]: row[1:] for row in db_connection.execute('SELECT file_path, file_size, mtime, content_hash FROM ingest_manifest;')}
+    known_hashes = {entry[2] for entry in manifest.values()}
+
+    changed_files = dict()
+    for file in tqdm(xlsx_files, desc='checking manifest'):
+        file_path = os.path.abspath(file)
+        file_stat = os.stat(file)
+        entry = manifest.get(file_path)
+        if entry is not None and entry[0] == file_stat.st_size and entry[1] == file_stat.st_mtime:
+            continue
+
+        content_hash = compute_file_hash(file)
+        if content_hash in known_hashes:
+            # Same content as an ingested file, only record the new path / mtime.
+            # Copies of a file of this run are recorded once it has been ingested.
+            if content_hash not in changed_files.values():
+                update_ingest_manifest(db_connection, file, content_hash)
+            continue
+
+        changed_files[file] = content_hash
+        known_hashes.add(content_hash)
+    return changed_files
+
+def update_ingest_manifest(db_connection, file, content_hash = None):
+    """
+    Records a workbook in the 'ingest_manifest' table after its data has been written.
+
+    Args:
+        db_connection (sqlite3.Connection): A SQLite database connection.
+        file (str): The path of the ingested file.
+        content_hash (str, optional): The content hash of the file. Computed if not given.
+
+    Returns:
+        None
+    """
+    if content_hash is None:
+        content_hash = compute_file_hash(file)
+    file_stat = os.stat(file)
+    db_connection.execute(
+        'INSERT OR REPLACE INTO ingest_manifest (file_path, file_size, mtime, content_hash, ingested_at) VALUES (?, ?, ?, ?, ?);',
+        (os.path.abspath(file), file_stat.st_size, file_stat.st_mtime, content_hash, datetime.now().isoformat()))
+    db_connection.commit()
+
+def create_trial_registry(db_connection):
+    """
+    Creates the 'ingested_trials' table with a unique index on the trial key
+    (Arena_ID, Trial_ID, Subject_ID, Start_time), and an index on the same columns of
+    'ethovision_data' so that the samples of a trial can be found without a table scan.
+
+    Args:
+        db_connection (sqlite3.Connection): A SQLite database connection.
+
+    Returns:
+        None
+    """
+    db_connection.execute("""
+    CREATE TABLE IF NOT EXISTS ingested_trials (
+        Arena_ID INTEGER,
+        Trial_ID TEXT,
+        Subject_ID TEXT,
+        Start_time TEXT,
+        num_samples INTEGER,
+        ingested_at TEXT
+    );
+    """)
+    db_connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS ingested_trials_key ON ingested_trials (Arena_ID, Trial_ID, Subject_ID, Start_time);')
+    db_connection.execute('CREATE INDEX IF NOT EXISTS ethovision_data_trial ON ethovision_data (Arena_ID, Trial_ID, Subject_ID, Start_time);')
+    db_connection.commit()
+
+def add_missing_columns(table_name, df, db_connection):
+    """
+    Adds the columns of a DataFrame that are missing in an existing table, so that
+    databases written by an older version of the reader can still be appended to.
+
+    Args:
+        table_name (str): The name of the table.
+        df (DataFrame): The data that will be written to the table.
+        db_connection (sqlite3.Connection): A SQLite database connection.
+
+    Returns:
+        None
+    """
+    table_columns = {row[1] for row in db_connection.execute(f'PRAGMA table_info("{table_name}");')}
+    if not table_columns:
+        return
+    for column in df.columns:
+        if column not in table_columns:
+            db_connection.execute(f'ALTER TABLE "{table_name}" ADD COLUMN "{column}";')
+    db_connection.commit()
+
+def write_ethovision_data(file_data, db_connection, if_trial_exists = None):
+    """
+    Writes the data returned by an EthoVision reader to the 'ethovision_data' table.
+
+    Databases created with the normalized layout are written by write_normalized_data.
+    Otherwise, without a trial mode the rows are simply appended. With if_trial_exists set, the
+    data is written trial by trial, keyed on (Arena_ID, Trial_ID, Subject_ID, Start_time).
+    Each trial is written in its own transaction: its old samples are deleted ('replace')
+    or the trial is left untouched ('skip') if it is already in the database. Running the
+    ingest twice or on overlapping folders therefore never duplicates samples.
+
+    Args:
+        file_data (DataFrame): The trajectory data with metadata of one or more trials.
+        db_connection (sqlite3.Connection): A SQLite database connection.
+        if_trial_exists (str, optional): None to append, 'replace' or 'skip' for trial-keyed
+                                         writing. Defaults to None.
+
+    Returns:
+        None
+    """
+    if file_data.empty:
+        return
+    if is_normalized(db_connection):
+        write_normalized_data(file_data, db_connection, if_trial_exists)
+        return
+    add_missing_columns('ethovision_data', file_data, db_connection)
+    if if_trial_exists is None:
+        file_data.to_sql('ethovision_data', db_connection, if_exists='append', index=False)
+        return
+    if if_trial_exists not in ('replace', 'skip'):
+        raise ValueError(f"if_trial_exists must be None, 'replace' or 'skip', not {if_trial_exists!r}")
+
+    # Create the table with the typed columns of the frame if it does not exist yet
+    file_data.head(0).to_sql('ethovision_data', db_connection, if_exists='append', index=False)
+    create_trial_registry(db_connection)
+
+    trial_key = ['Arena_ID', 'Trial_ID', 'Subject_ID', 'Start_time']
+    key_condition = ' AND '.join(f'"{column}" IS ?' for column in trial_key)
+    column_str = ', '.join(f'"{column}"' for column in file_data.columns)
+    insert_query = f'INSERT INTO ethovision_data ({column_str}) VALUES ({", ".join("?" * len(file_data.columns))});'
+
+    for key, trial_data in file_data.groupby(trial_key, sort=False, dropna=False, observed=True):
+        key = tuple(None if pd.isna(value) else value.item() if hasattr(value, 'item') else value for value in key)
+        rows = trial_data.astype(object).where(trial_data.notna(), None)
+
+        with db_connection:
+            if if_trial_exists == 'skip':
+                exists = db_connection.execute(f'SELECT 1 FROM ethovision_data WHERE {key_condition} LIMIT 1;', key).fetchone()
+                if exists is not None:
+                    continue
+            else:
+                db_connection.execute(f'DELETE FROM ethovision_data WHERE {key_condition};', key)
+
+            db_connection.executemany(insert_query, rows.itertuples(index=False))
+            db_connection.execute(
+                'INSERT OR REPLACE INTO ingested_trials (Arena_ID, Trial_ID, Subject_ID, Start_time, num_samples, ingested_at) VALUES (?, ?, ?, ?, ?, ?);',
+                key + (len(trial_data), datetime.now().isoformat()))
+
+def write_tracking_quality(quality_data, db_connection):
+    """
+    Writes the tracking quality summaries of an EthoVision reader to the
+    'tracking_quality' table, replacing earlier summaries of the same trials.
+
+    Bad trials can then be excluded with a query on this table, e.g.
+    SELECT * FROM tracking_quality WHERE dropout_fraction > 0.1 OR NOT time_monotonic.
+
+    Args:
+        quality_data (DataFrame): The table returned by get_tracking_quality_table.
+        db_connection (sqlite3.Connection): A SQLite database connection.
+
+    Returns:
+        None
+    """
+    if quality_data.empty:
+        return
+
+    add_missing_columns('tracking_quality', quality_data, db_connection)
+    trial_key = ['Arena_ID', 'Trial_ID', 'Subject_ID', 'Start_time']
+    table_exists = db_connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tracking_quality';").fetchone()
+    if table_exists is not None:
+        key_condition = ' AND '.join(f'"{column}" IS ?' for column in trial_key)
+        keys = quality_data[trial_key].astype(object).where(quality_data[trial_key].notna(), None)
+        keys = [tuple(value.item() if hasattr(value, 'item') else value for value in key) for key in keys.itertuples(index=False)]
+        db_connection.executemany(f'DELETE FROM tracking_quality WHERE {key_condition};', keys)
+
+    quality_data.to_sql('tracking_quality', db_connection, if_exists='append', index=False)
+
+def get_subjects(file_data):
+    """
+    Returns the subjects in the data returned by an EthoVision reader.
+
+    Args:
+        file_data (DataFrame): The trajectory data with metadata.
+
+    Returns:
+        set: The (Tank_number, ID) pairs.
+    """
+    if file_data is None or file_data.empty:
+        return set()
+    return set(file_data[['Tank_number', 'ID']].drop_duplicates().itertuples(index=False, name=None))
+
 def read_all_ethovision_files_to_pandas(xlsx_files):
     """
     Reads all EthoVision Excel files in the given list using the EthoVisionReader class.
@@ -35,14 +331,35 @@ def read_all_ethovision_files_to_pandas(xlsx_files):
     all_data = []
 
     for file in tqdm(xlsx_files,desc='reading files'):
-        etho_vision_reader = EthoVisionReader(file)
+        etho_vision_reader = make_ethovision_reader(file)
         file_data = etho_vision_reader.main()
         all_data.append(file_data)
 
     return pd.concat(all_data)
 
 
-def read_all_ethovision_files_to_sql(xlsx_files, db_connection,correction_mode = False):
+def calibrate_tanks(files, cache_filename, correction_mode = False, overwrite = False):
+    """
+    Estimates the tank corners of every recording session in the given files and
+    caches them, see EthoVisionTankCalibration. The files are streamed once.
+
+    Args:
+        files (list): A list of EthoVision export paths.
+        cache_filename (str): The JSON file the calibrations are cached in.
+        correction_mode (bool, optional): Must match the correction mode of the ingest. Defaults to False.
+        overwrite (bool, optional): If True, sessions in the cache are estimated again. Defaults to False.
+
+    Returns:
+        EthoVisionTankCalibration: The calibration, to be passed on to the ingest.
+    """
+    tank_calibration = EthoVisionTankCalibration(cache_filename)
+    readers = (make_ethovision_reader(file, correction_mode=correction_mode, streaming_mode=True) for file in tqdm(files, desc='calibrating tanks'))
+    new_calibrations = tank_calibration.calibrate(readers, overwrite)
+    for session_key, arenas in sorted(new_calibrations.items()):
+        print(f'{session_key}: calibrated arenas {sorted(arenas)}')
+    return tank_calibration
+
+def read_all_ethovision_files_to_sql(xlsx_files, db_connection,correction_mode = False, streaming_mode = False, incremental_mode = False, if_trial_exists = None, num_sheet_workers = 1, tank_calibration = None, excel_engine = None):
     """
     Reads all EthoVision Excel files in the given list using the EthoVisionReader class
     and stores the data in the provided SQLite database.
@@ -50,63 +367,241 @@ def read_all_ethovision_files_to_sql(xlsx_files, db_connection,correction_mode =
     Args:
         xlsx_files (list): A list of .xlsx file paths to read.
         db_connection (sqlite3.Connection): A SQLite database connection.
+        streaming_mode (bool, optional): If True, each sheet is written to the database
+                                         as soon as it is parsed, so only one sheet is
+                                         held in memory at a time. Defaults to False.
+        incremental_mode (bool, optional): If True, workbooks already recorded in the
+                                           'ingest_manifest' table are skipped and every
+                                           written workbook is added to it. Modified workbooks
+                                           are read again, so their trials replace the stored
+                                           ones unless if_trial_exists is set. Defaults to False.
+        if_trial_exists (str, optional): None to append, 'replace' or 'skip' to write trial by
+                                         trial, see write_ethovision_data. Defaults to None.
+        num_sheet_workers (int, optional): The number of processes reading and processing the
+                                           sheets of each workbook. Defaults to 1.
+        tank_calibration (EthoVisionTankCalibration, optional): Per-session tank corners,
+                                           see calibrate_tanks. Defaults to None.
+        excel_engine (str, optional): The Excel engine of the readers, e.g. 'auto', see
+                                      EthoVisionReader. Defaults to None.
 
     Returns:
         None
     """
+    if incremental_mode:
+        content_hashes = get_changed_files(xlsx_files, db_connection)
+        xlsx_files = list(content_hashes)
+        if if_trial_exists is None:
+            # Appending the trials of a modified workbook again would duplicate them
+            if_trial_exists = 'replace'
+
+    written_subjects = set()
     pbar= tqdm(total=len(xlsx_files))
     for file in  xlsx_files:
         pbar.set_description(f'reading file: {file}')
-        etho_vision_reader = EthoVisionReader(file,correction_mode=correction_mode)
-        file_data = etho_vision_reader.main()
-        file_data.to_sql('ethovision_data', db_connection, if_exists='append', index=False)
+        etho_vision_reader = make_ethovision_reader(file,correction_mode=correction_mode,streaming_mode=streaming_mode,num_workers=num_sheet_workers,tank_calibration=tank_calibration,excel_engine=excel_engine)
+        if streaming_mode:
+            for sheet_data in etho_vision_reader.iter_trajectories():
+                write_ethovision_data(sheet_data, db_connection, if_trial_exists)
+                written_subjects.update(get_subjects(sheet_data))
+        else:
+            file_data = etho_vision_reader.main()
+            write_ethovision_data(file_data, db_connection, if_trial_exists)
+            written_subjects.update(get_subjects(file_data))
+        write_tracking_quality(etho_vision_reader.get_tracking_quality_table(), db_connection)
+        if incremental_mode:
+            update_ingest_manifest(db_connection, file, content_hashes[file])
         pbar.update()
     pbar.close()
+    # The indexes first: they fill in missing start epochs, which the day numbers are computed from
+    create_ethovision_indexes(db_connection)
+    update_day_numbers(db_connection, written_subjects)
+
+def read_ethovision_file(file, correction_mode = False, tank_calibration = None, excel_engine = None):
+    """
+    Reads a single EthoVision Excel file. This is the worker function of
+    read_all_ethovision_files_to_sql_parallel and never raises, so that a broken
+    workbook does not stop the ingest of the other files.
+
+    Args:
+        file (str): The .xlsx file path to read.
+        correction_mode (bool, optional): Passed on to the EthoVisionReader. Defaults to False.
+        tank_calibration (EthoVisionTankCalibration, optional): Passed on to the EthoVisionReader. Defaults to None.
+        excel_engine (str, optional): Passed on to the EthoVisionReader. Defaults to None.
+
+    Returns:
+        tuple: The file path, the DataFrame returned by EthoVisionReader.main() and the
+               tracking quality table (both None on failure), and an error message (None
+               on success).
+    """
+    try:
+        etho_vision_reader = make_ethovision_reader(file,correction_mode=correction_mode,tank_calibration=tank_calibration,excel_engine=excel_engine)
+        file_data = etho_vision_reader.main()
+        return file, file_data, etho_vision_reader.get_tracking_quality_table(), None
+    except Exception as e:
+        return file, None, None, f'{type(e).__name__}: {e}'
+
+
+def read_all_ethovision_files_to_sql_parallel(xlsx_files, db_connection, correction_mode = False, num_workers = None, max_pending = None, incremental_mode = False, if_trial_exists = None, tank_calibration = None, excel_engine = None):
+    """
+    Reads all EthoVision Excel files in the given list with a pool of worker processes
+    and stores the data in the provided SQLite database.
+
+    Each worker parses one workbook at a time. The finished frames are handed back to
+    the calling process, which is the only writer to the database. At most max_pending
+    workbooks are submitted at once, so parsed frames waiting to be written cannot pile
+    up in memory. Files that fail to parse are reported and skipped.
+
+    Args:
+        xlsx_files (list): A list of .xlsx file paths to read.
+        db_connection (sqlite3.Connection): A SQLite database connection.
+        correction_mode (bool, optional): Passed on to the EthoVisionReader. Defaults to False.
+        num_workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+        max_pending (int, optional): The maximum number of workbooks in flight (queued, parsing
+                                     or waiting to be written). Defaults to 2 * num_workers.
+        incremental_mode (bool, optional): If True, workbooks already recorded in the
+                                           'ingest_manifest' table are skipped and every
+                                           written workbook is added to it. Modified workbooks
+                                           are read again, so their trials replace the stored
+                                           ones unless if_trial_exists is set. Defaults to False.
+        if_trial_exists (str, optional): None to append, 'replace' or 'skip' to write trial by
+                                         trial, see write_ethovision_data. Defaults to None.
+        tank_calibration (EthoVisionTankCalibration, optional): Per-session tank corners,
+                                         see calibrate_tanks. Defaults to None.
+        excel_engine (str, optional): The Excel engine of the readers, e.g. 'auto', see
+                                      EthoVisionReader. Defaults to None.
+
+    Returns:
+        list: A list of (file, error message) tuples for the files that could not be read.
+    """
+    if incremental_mode:
+        content_hashes = get_changed_files(xlsx_files, db_connection)
+        xlsx_files = list(content_hashes)
+        if if_trial_exists is None:
+            # Appending the trials of a modified workbook again would duplicate them
+            if_trial_exists = 'replace'
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * num_workers
+
+    file_iter = iter(xlsx_files)
+    failed_files = list()
+    written_subjects = set()
+    pbar= tqdm(total=len(xlsx_files), desc='reading files')
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        pending = dict()
+
+        def submit_next():
+            file = next(file_iter, None)
+            if file is not None:
+                pending[executor.submit(read_ethovision_file, file, correction_mode, tank_calibration, excel_engine)] = file
+
+        for _ in range(max_pending):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                file = pending.pop(future)
+                try:
+                    file, file_data, quality_data, error = future.result()
+                except Exception as e:
+                    file_data, quality_data, error = None, None, f'{type(e).__name__}: {e}'
+
+                if error is None:
+                    pbar.set_description(f'writing file: {file}')
+                    write_ethovision_data(file_data, db_connection, if_trial_exists)
+                    written_subjects.update(get_subjects(file_data))
+                    write_tracking_quality(quality_data, db_connection)
+                    if incremental_mode:
+                        update_ingest_manifest(db_connection, file, content_hashes[file])
+                else:
+                    print(f"Error reading {file}: {error}")
+                    failed_files.append((file, error))
+
+                del file_data, quality_data
+                pbar.update()
+                submit_next()
+
+    pbar.close()
+    # The indexes first: they fill in missing start epochs, which the day numbers are computed from
+    create_ethovision_indexes(db_connection)
+    update_day_numbers(db_connection, written_subjects)
+    return failed_files
+
+def read_all_ethovision_files_to_parquet(xlsx_files, parquet_db, correction_mode = False, tank_calibration = None, excel_engine = None):
+    """
+    Reads all EthoVision files in the given list in streaming mode and stores the
+    data in a partitioned Parquet dataset, see EthoVisionParquetDataBase. Trials
+    that are already stored are replaced.
+
+    Args:
+        xlsx_files (list): A list of EthoVision export paths to read.
+        parquet_db (EthoVisionParquetDataBase): The Parquet dataset to write to.
+        correction_mode (bool, optional): Passed on to the EthoVisionReader. Defaults to False.
+        tank_calibration (EthoVisionTankCalibration, optional): Passed on to the EthoVisionReader. Defaults to None.
+        excel_engine (str, optional): Passed on to the EthoVisionReader. Defaults to None.
+
+    Returns:
+        None
+    """
+    for file in tqdm(xlsx_files, desc='writing parquet'):
+        etho_vision_reader = make_ethovision_reader(file,correction_mode=correction_mode,streaming_mode=True,tank_calibration=tank_calibration,excel_engine=excel_engine)
+        for sheet_data in etho_vision_reader.iter_trajectories():
+            parquet_db.write_data(sheet_data)
 
-def create_database(db_name):
+def create_database(db_name, normalized = False):
     """
     Creates a new SQLite database with the specified name.
 
     Args:
         db_name (str): The name of the SQLite database file.
+        normalized (bool, optional): If True, the data is stored in the normalized
+                                     subjects / trials / samples layout, see
+                                     create_normalized_schema. Defaults to False.
 
     Returns:
         sqlite3.Connection: A connection to the SQLite database.
     """
-    return sqlite3.connect(db_name)
+    db_connection = sqlite3.connect(db_name)
+    if normalized:
+        create_normalized_schema(db_connection)
+    return db_connection
 
-# Specify the folder to search for .xlsx files
-#folder = "/media/bgeurten/HSMovieKrissy/Hab_rawData"
-#folder = "/home/bgeurten/METH/raw_data/"
-folder = '/media/bgeurten/Alex_stuff/master/rehab/'
+if __name__ == '__main__':
+    # Specify the folder to search for .xlsx files
+    #folder = "/media/bgeurten/HSMovieKrissy/Hab_rawData"
+    #folder = "/home/bgeurten/METH/raw_data/"
+    folder = '/media/bgeurten/Alex_stuff/master/rehab/'
 
 
 
-# Get a list of all .xlsx files in the folder and its subdirectories
-xlsx_files = get_all_xlsx_files(folder)
+    # Get a list of all .xlsx files in the folder and its subdirectories
+    xlsx_files = get_all_xlsx_files(folder)
 
-# Create a SQLite database and connect to it
-db_name = "/home/bgeurten/ethoVision_database/rehabituation2023_ethovision_data.db"
-db_connection = create_database(db_name)
+    # Create a SQLite database and connect to it
+    db_name = "/home/bgeurten/ethoVision_database/rehabituation2023_ethovision_data.db"
+    db_connection = create_database(db_name)
 
-# Read all EthoVision Excel files and store the data in the SQLite database
-read_all_ethovision_files_to_sql(xlsx_files, db_connection,correction_mode=False)
+    # Read all EthoVision Excel files and store the data in the SQLite database
+    read_all_ethovision_files_to_sql(xlsx_files, db_connection,correction_mode=False,incremental_mode=True,if_trial_exists='replace',excel_engine='auto')
 
-# Close the database connection
-db_connection.close()
+    # Close the database connection
+    db_connection.close()
 
-folder = '/media/bgeurten/Alex_stuff/master/METH/raw/'
+    folder = '/media/bgeurten/Alex_stuff/master/METH/raw/'
 
 
-# Get a list of all .xlsx files in the folder and its subdirectories
-xlsx_files = get_all_xlsx_files(folder)
+    # Get a list of all .xlsx files in the folder and its subdirectories
+    xlsx_files = get_all_xlsx_files(folder)
 
-# Create a SQLite database and connect to it
-db_name = "/home/bgeurten/ethoVision_database/meth2023_ethovision_data.db"
-db_connection = create_database(db_name)
+    # Create a SQLite database and connect to it
+    db_name = "/home/bgeurten/ethoVision_database/meth2023_ethovision_data.db"
+    db_connection = create_database(db_name)
 
-# Read all EthoVision Excel files and store the data in the SQLite database
-read_all_ethovision_files_to_sql(xlsx_files, db_connection,correction_mode=False)
+    # Read all EthoVision Excel files and store the data in the SQLite database
+    read_all_ethovision_files_to_sql(xlsx_files, db_connection,correction_mode=False,incremental_mode=True,if_trial_exists='replace',excel_engine='auto')
 
-# Close the database connection
-db_connection.close()
\ No newline at end of file
+    # Close the database connection
+    db_connection.close()
@@ -0,0 +1,59 @@
+import os
+from tqdm import tqdm
+from data_handlers.EthoVisionArrowReader import convert_to_arrow
+from run_scripts.run_ethoTrackReader import get_all_ethovision_files, make_ethovision_reader
+
+def get_arrow_filename(file, source_folder, archive_folder):
+    """
+    Returns the archive filename of an EthoVision export, mirroring its path below
+    the source folder inside the archive folder.
+
+    Args:
+        file (str): The path of the EthoVision export.
+        source_folder (str): The folder the export was found in.
+        archive_folder (str): The folder of the Arrow archive.
+
+    Returns:
+        str: The path of the .feather file.
+    """
+    relative_path = os.path.relpath(file, source_folder)
+    return os.path.join(archive_folder, os.path.splitext(relative_path)[0] + '.feather')
+
+def convert_all_ethovision_files_to_arrow(ethovision_files, source_folder, archive_folder, overwrite = False):
+    """
+    Converts all EthoVision exports in the given list into Arrow archives. Exports whose
+    archive is newer than the export itself are skipped unless overwrite is set.
+
+    Args:
+        ethovision_files (list): A list of .xlsx / .txt file paths to convert.
+        source_folder (str): The folder the exports were found in.
+        archive_folder (str): The folder of the Arrow archive.
+        overwrite (bool, optional): If True, existing archives are rewritten. Defaults to False.
+
+    Returns:
+        list: The paths of the written (or up to date) .feather files.
+    """
+    arrow_files = list()
+    for file in tqdm(ethovision_files, desc='converting files'):
+        arrow_filename = get_arrow_filename(file, source_folder, archive_folder)
+        if not overwrite and os.path.exists(arrow_filename) and os.path.getmtime(arrow_filename) >= os.path.getmtime(file):
+            arrow_files.append(arrow_filename)
+            continue
+
+        os.makedirs(os.path.dirname(arrow_filename), exist_ok=True)
+        etho_vision_reader = make_ethovision_reader(file, streaming_mode=True)
+        if convert_to_arrow(etho_vision_reader, arrow_filename) > 0:
+            arrow_files.append(arrow_filename)
+        else:
+            print(f"No samples logged in {file}, nothing archived")
+    return arrow_files
+
+if __name__ == '__main__':
+    # Specify the folder to search for EthoVision exports and the archive folder
+    folder = '/media/bgeurten/Alex_stuff/master/METH/raw/'
+    archive_folder = '/home/bgeurten/ethoVision_database/arrow_archive/METH/'
+
+    # Convert every workbook once; the SQLite ingest can then read the .feather files
+    # via read_all_ethovision_files_to_sql(get_all_ethovision_files(archive_folder, ('.feather',)), ...)
+    ethovision_files = get_all_ethovision_files(folder)
+    convert_all_ethovision_files_to_arrow(ethovision_files, folder, archive_folder)
@@ -0,0 +1,174 @@
+import os
+import sqlite3
+import tempfile
+import time
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from data_handlers.EthoVisionReader import EthoVisionReader
+from data_handlers.EthoVisionSyntheticData import EthoVisionSyntheticData
+from data_handlers.EthoVisionArrowReader import convert_to_arrow
+from run_scripts.run_ethoTrackReader import make_ethovision_reader, write_ethovision_data
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def get_peak_memory_mb(children = False):
+    """
+    Returns the peak resident memory of the current process, or of its largest
+    terminated child process, e.g. a worker of a process pool.
+
+    Args:
+        children (bool, optional): If True, the peak of the child processes is returned. Defaults to False.
+
+    Returns:
+        float: The peak RSS in MiB, or NaN where the resource module is not available (Windows).
+    """
+    if resource is None:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / 1024 ** 2 if os.uname().sysname == 'Darwin' else peak / 1024
+
+def time_reader(files, reader_kwargs):
+    """
+    Times EthoVisionReader.main() on the given files. Meant to run in a fresh process,
+    so that the peak memory belongs to this case only.
+
+    Args:
+        files (list): The EthoVision exports to read.
+        reader_kwargs (dict): Passed on to the reader.
+
+    Returns:
+        dict: The number of rows, the time in seconds and the peak memory of the process
+              and of its workers in MiB.
+    """
+    start = time.perf_counter()
+    num_rows = 0
+    for file in files:
+        etho_vision_reader = make_ethovision_reader(file, **reader_kwargs)
+        if reader_kwargs.get('streaming_mode'):
+            num_rows += sum(len(df) for df in etho_vision_reader.iter_trajectories())
+        else:
+            num_rows += len(etho_vision_reader.main())
+    seconds = time.perf_counter() - start
+    return {'rows': num_rows, 'seconds': seconds, 'peak_memory_mb': get_peak_memory_mb(),
+            'peak_worker_memory_mb': get_peak_memory_mb(children=True)}
+
+def write_parsed_files(files, folder):
+    """
+    Parses the given files and pickles their data, so that the SQLite cases only
+    load the parsed frames and their peak memory does not include the reader.
+
+    Args:
+        files (list): The EthoVision exports to parse.
+        folder (str): The folder for the pickled frames.
+
+    Returns:
+        list: The paths of the pickled frames.
+    """
+    os.makedirs(folder, exist_ok=True)
+    parsed_files = list()
+    for file in files:
+        parsed_filename = os.path.join(folder, os.path.basename(file) + '.pkl')
+        make_ethovision_reader(file).main().to_pickle(parsed_filename)
+        parsed_files.append(parsed_filename)
+    return parsed_files
+
+def time_sql_load(parsed_files, if_trial_exists = None):
+    """
+    Times writing parsed data to a new SQLite database. Only the database load is
+    timed, and the peak memory is that of the parsed frames and the load.
+
+    Args:
+        parsed_files (list): The pickled frames returned by write_parsed_files.
+        if_trial_exists (str, optional): Passed on to write_ethovision_data. Defaults to None.
+
+    Returns:
+        dict: The number of rows, the time in seconds and the peak memory of the process
+              and of its workers in MiB.
+    """
+    file_data = [pd.read_pickle(parsed_file) for parsed_file in parsed_files]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_connection = sqlite3.connect(os.path.join(tmp_dir, 'benchmark.db'))
+        start = time.perf_counter()
+        for df in file_data:
+            write_ethovision_data(df, db_connection, if_trial_exists)
+        db_connection.commit()
+        seconds = time.perf_counter() - start
+        db_connection.close()
+    return {'rows': sum(len(df) for df in file_data), 'seconds': seconds, 'peak_memory_mb': get_peak_memory_mb(),
+            'peak_worker_memory_mb': get_peak_memory_mb(children=True)}
+
+def run_case(function, *args):
+    """
+    Runs a benchmark case in a fresh worker process.
+
+    Args:
+        function (callable): time_reader or time_sql_load.
+        *args: The arguments of the function.
+
+    Returns:
+        dict: The result of the function.
+    """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(function, *args).result()
+
+def run_ingest_benchmark(folder, num_arenas = 4, num_trials = 2, duration_s = 600.0):
+    """
+    Writes a synthetic campaign in Excel, text and Arrow format and measures the
+    ingest throughput of every reader backend and of the SQLite load.
+
+    Args:
+        folder (str): The folder for the synthetic files.
+        num_arenas (int, optional): The number of arenas per trial. Defaults to 4.
+        num_trials (int, optional): The number of trials. Defaults to 2.
+        duration_s (float, optional): The duration of each track in seconds. Defaults to 600.
+
+    Returns:
+        DataFrame: One row per case with rows, seconds, rows per second, the peak memory
+                   of the case and that of its largest worker process (0 without workers).
+                   The SQLite cases load frames parsed beforehand, so their memory does not
+                   include the reader.
+    """
+    generator = EthoVisionSyntheticData(num_arenas=num_arenas, num_trials=num_trials, duration_s=duration_s)
+    xlsx_files = generator.write_campaign(os.path.join(folder, 'xlsx'), 'xlsx')
+    txt_files = generator.write_campaign(os.path.join(folder, 'txt'), 'txt')
+
+    os.makedirs(os.path.join(folder, 'arrow'), exist_ok=True)
+    arrow_files = list()
+    for file in xlsx_files:
+        arrow_filename = os.path.join(folder, 'arrow', os.path.basename(file).replace('.xlsx', '.feather'))
+        convert_to_arrow(make_ethovision_reader(file, streaming_mode=True), arrow_filename)
+        arrow_files.append(arrow_filename)
+    parsed_files = run_case(write_parsed_files, xlsx_files, os.path.join(folder, 'parsed'))
+
+    cases = {'excel':                (time_reader, xlsx_files, {}),
+             'excel streaming':      (time_reader, xlsx_files, {'streaming_mode': True}),
+             'excel 4 workers':      (time_reader, xlsx_files, {'num_workers': 4}),
+             'excel calamine':       (time_reader, xlsx_files, {'excel_engine': 'calamine'}),
+             'excel auto':           (time_reader, xlsx_files, {'excel_engine': 'auto'}),
+             'text':                 (time_reader, txt_files, {}),
+             'arrow':                (time_reader, arrow_files, {}),
+             'sqlite append':        (time_sql_load, parsed_files, None),
+             'sqlite trial replace': (time_sql_load, parsed_files, 'replace')}
+
+    if 'calamine' not in EthoVisionReader(None, streaming_mode=True).get_available_excel_engines():
+        del cases['excel calamine']
+
+    results = list()
+    for case, (function, files, option) in cases.items():
+        result = run_case(function, files, option)
+        result['case'] = case
+        result['rows_per_s'] = result['rows'] / result['seconds']
+        results.append(result)
+        print(f"{case:22s} {result['rows']:10d} rows {result['seconds']:8.2f} s {result['rows_per_s']:12.0f} rows/s "
+              f"{result['peak_memory_mb']:8.1f} MiB {result['peak_worker_memory_mb']:8.1f} MiB per worker")
+
+    return pd.DataFrame(results)[['case', 'rows', 'seconds', 'rows_per_s', 'peak_memory_mb', 'peak_worker_memory_mb']]
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as benchmark_folder:
+        results = run_ingest_benchmark(benchmark_folder)
+    print(results)
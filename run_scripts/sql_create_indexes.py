@@ -0,0 +1,43 @@
+import sqlite3
+import sys
+import time
+from fish_data_base.EthoVisionSQLdataBase import create_ethovision_indexes, create_ethovision_data_view, is_normalized, update_day_numbers
+
+def migrate_database(fileposition):
+    """
+    Adds the subject indexes of EthoVisionSQLdataBase to an existing database, so
+    that per-subject queries no longer scan the whole 'ethovision_data' table.
+    Indexes that already exist are left untouched, so the migration can be run
+    repeatedly. Rows ingested before the 'Start_time_epoch' column existed get their
+    epoch and 'Day_number', so that the subjects are returned in recording order
+    straight from the index. The 'ethovision_data' view of a normalized database is
+    recreated, so that its columns follow the current order of the wide table.
+
+    Building the indexes of a multi-GB table takes a few minutes and needs about
+    as much free disk space as the indexed columns.
+
+    Args:
+        fileposition (str): The path of the SQLite database.
+
+    Returns:
+        None
+    """
+    conn = sqlite3.connect(fileposition)
+    start = time.perf_counter()
+    created_indexes = create_ethovision_indexes(conn)
+    update_day_numbers(conn)
+    if is_normalized(conn):
+        create_ethovision_data_view(conn)
+        conn.commit()
+    conn.close()
+
+    if created_indexes:
+        print(f'{fileposition}: created {", ".join(created_indexes)} in {time.perf_counter() - start:.1f} s')
+    else:
+        print(f'{fileposition}: indexes already present')
+
+if __name__ == '__main__':
+    # python -m run_scripts.sql_create_indexes first.db second.db ...
+    db_files = sys.argv[1:] or ['/home/bgeurten/ethoVision_database/combined_ethovision_data.db']
+    for db_file in db_files:
+        migrate_database(db_file)
@@ -1,43 +1,332 @@
+import os
 import sqlite3
+import sys
+import time
+from tqdm import tqdm
+from fish_data_base.EthoVisionSQLdataBase import ETHOVISION_DATA_INDEXES, OBSOLETE_INDEXES, SUBJECT_COLUMNS, TRIAL_COLUMNS, TRIAL_KEY, create_ethovision_indexes, is_numeric_column_type, update_day_numbers
 
-def combine_databases(filepath):
+def get_source_tables(db_connection, table):
     """
-    This function combines the 'ethovision_data' tables from three SQLite databases into one in a new database.
+    Describes how to read a table of the attached source database.
 
-    The databases are 'habituation2023_ethovision_data.db', 'rehabituation_2023.db', and 'meth_administration_2023.db'. The data from the tables in these
-    databases is copied into a new 'ethovision_data' table in a new database 'combined_database.db'.
+    Wide tables are read as they are. The 'ethovision_data' view of a normalized
+    database is read from its 'samples', 'trials' and 'subjects' tables instead, so
+    that it can be copied in ranges of sample rowids and its trial keys are read
+    from the 'trials' table.
 
-    Note: Make sure that the 'ethovision_data' tables in all three databases have the same structure.
+    Args:
+        db_connection (sqlite3.Connection): A connection with the source attached as 'source'.
+        table (str): 'ethovision_data' or 'tracking_quality'.
+
+    Returns:
+        dict: The column expressions ('columns', name -> (expression, declared type)),
+              the FROM clause of the rows ('from'), the table their rowid comes from
+              ('rows') and its rowid ('rowid'), and the FROM clause to read the trial
+              keys from ('trials'), or None if the source has no such table.
+    """
+    row = db_connection.execute("SELECT type FROM source.sqlite_master WHERE name = ?;", (table,)).fetchone()
+    if row is None:
+        return None
+
+    if row[0] == 'view':
+        columns = {info[1]: (f'sa."{info[1]}"', info[2]) for info in db_connection.execute('PRAGMA source.table_info(samples);') if info[1] != 'trial_key'}
+        columns.update({info[1]: (f'su."{info[1]}"', info[2]) for info in db_connection.execute('PRAGMA source.table_info(subjects);') if info[1] in SUBJECT_COLUMNS})
+        columns.update({info[1]: (f't."{info[1]}"', info[2]) for info in db_connection.execute('PRAGMA source.table_info(trials);') if info[1] in TRIAL_COLUMNS})
+        return {'columns': columns,
+                'from': 'source.samples sa JOIN source.trials t ON t.trial_key = sa.trial_key JOIN source.subjects su ON su.subject_key = t.subject_key',
+                'rows': 'source.samples sa',
+                'rowid': 'sa.rowid',
+                'trials': 'source.trials t'}
+
+    columns = {info[1]: (f's."{info[1]}"', info[2]) for info in db_connection.execute(f'PRAGMA source.table_info("{table}");')}
+    return {'columns': columns, 'from': f'source."{table}" s', 'rows': f'source."{table}" s', 'rowid': 's.rowid', 'trials': f'source."{table}" s'}
+
+def get_merged_columns(db_connection, source_files, table):
+    """
+    Collects the columns of a table over all sources, in the order they first
+    appear. Where the sources declare a column differently, the numeric type wins,
+    so that data of a database ingested before the typed schema (every column TEXT)
+    does not turn the merged measurements back into text.
+
+    Args:
+        db_connection (sqlite3.Connection): A connection to the target database.
+        source_files (list): The paths of the databases to merge.
+        table (str): 'ethovision_data' or 'tracking_quality'.
+
+    Returns:
+        dict: Maps the column names to their declared types.
+    """
+    columns = dict()
+    for source_file in source_files:
+        db_connection.execute('ATTACH DATABASE ? AS source;', (source_file,))
+        source_tables = get_source_tables(db_connection, table)
+        db_connection.execute('DETACH DATABASE source;')
+        if source_tables is None:
+            continue
+        for name, (expression, column_type) in source_tables['columns'].items():
+            if name not in columns or (is_numeric_column_type(column_type) and not is_numeric_column_type(columns[name])):
+                columns[name] = column_type
+    return columns
+
+def reconcile_columns(db_connection, table, columns):
+    """
+    Creates the target table, or adds the columns it is missing, so that every
+    column of the sources can be copied. Columns are matched by name; target columns
+    a source does not have are left NULL for its rows. Existing target columns keep
+    their declared type.
+
+    Args:
+        db_connection (sqlite3.Connection): A connection to the target database.
+        table (str): The name of the target table.
+        columns (dict): The columns returned by get_merged_columns, name -> declared type.
+
+    Returns:
+        None
+    """
+    table_columns = {row[1] for row in db_connection.execute(f'PRAGMA main.table_info("{table}");')}
+    with db_connection:
+        if not table_columns:
+            column_str = ', '.join(f'"{name}" {column_type}' for name, column_type in columns.items())
+            db_connection.execute(f'CREATE TABLE main."{table}" ({column_str});')
+            return
+        for name, column_type in columns.items():
+            if name not in table_columns:
+                db_connection.execute(f'ALTER TABLE main."{table}" ADD COLUMN "{name}" {column_type};')
+
+def get_key_expression(source_tables, column):
+    """
+    Returns the expression of a trial key column of the source as text, so that
+    keys stored as INTEGER in one database and as TEXT in another still match.
+
+    Args:
+        source_tables (dict): The source description returned by get_source_tables.
+        column (str): The name of the key column.
+
+    Returns:
+        str: The SQL expression, NULL if the source does not have the column.
+    """
+    if column not in source_tables['columns']:
+        return 'NULL'
+    return f'CAST({source_tables["columns"][column][0]} AS TEXT)'
+
+def find_duplicate_trials(db_connection, source_tables):
+    """
+    Collects the trial keys (Arena_ID, Trial_ID, Subject_ID, Start_time) of the
+    source in temp.source_trials, and those already merged from the target or an
+    earlier source in temp.duplicate_trials.
+
+    Args:
+        db_connection (sqlite3.Connection): A connection with the source attached as 'source'.
+        source_tables (dict): The source description returned by get_source_tables.
+
+    Returns:
+        int: The number of duplicate trials.
+    """
+    key_str = ', '.join(f'{get_key_expression(source_tables, column)} AS "{column}"' for column in TRIAL_KEY)
+    match_str = ' AND '.join(f'm."{column}" IS s."{column}"' for column in TRIAL_KEY)
+    with db_connection:
+        db_connection.execute('DROP TABLE IF EXISTS temp.source_trials;')
+        db_connection.execute('DROP TABLE IF EXISTS temp.duplicate_trials;')
+        db_connection.execute(f'CREATE TEMP TABLE source_trials AS SELECT DISTINCT {key_str} FROM {source_tables["trials"]};')
+        db_connection.execute(f"""
+        CREATE TEMP TABLE duplicate_trials AS
+        SELECT * FROM temp.source_trials s
+        WHERE EXISTS (SELECT 1 FROM temp.merged_trials m WHERE {match_str});
+        """)
+        db_connection.execute(f'CREATE INDEX temp.duplicate_trials_key ON duplicate_trials ({", ".join(TRIAL_KEY)});')
+    return db_connection.execute('SELECT COUNT(*) FROM temp.duplicate_trials;').fetchone()[0]
+
+def get_copy_ranges(db_connection, source_tables):
+    """
+    Returns the rowid ranges of the source rows to copy.
+
+    A trial is written as one contiguous run of rows, so a trial that was appended
+    to the source more than once shows up as several runs with the same key
+    (Arena_ID, Trial_ID, Subject_ID, Start_time). Only the first run of every key
+    is copied, and none of the trials in temp.duplicate_trials.
+
+    Args:
+        db_connection (sqlite3.Connection): A connection with the source attached as 'source'.
+        source_tables (dict): The source description returned by get_source_tables.
+
+    Returns:
+        tuple: The list of (first rowid, last rowid) ranges in rowid order, and the
+               number of repeated runs of trials that are not already merged.
+    """
+    rowid = source_tables['rowid']
+    key_str = ', '.join(f'{get_key_expression(source_tables, column)} AS "{column}"' for column in TRIAL_KEY)
+    previous_str = ', '.join(f'LAG("{column}") OVER (ORDER BY source_rowid) AS "previous_{column}"' for column in TRIAL_KEY)
+    change_str = ' OR '.join(f'"{column}" IS NOT "previous_{column}"' for column in TRIAL_KEY)
+    column_str = ', '.join(f'"{column}"' for column in TRIAL_KEY)
+    match_str = ' AND '.join(f'd."{column}" IS r."{column}"' for column in TRIAL_KEY)
+    with db_connection:
+        db_connection.execute('DROP TABLE IF EXISTS temp.source_runs;')
+        db_connection.execute(f"""
+        CREATE TEMP TABLE source_runs AS
+        SELECT {column_str}, source_rowid AS first_rowid,
+               LEAD(source_rowid) OVER (ORDER BY source_rowid) - 1 AS last_rowid,
+               source_rowid = MIN(source_rowid) OVER (PARTITION BY {column_str}) AS is_first
+        FROM (SELECT *, {previous_str}
+              FROM (SELECT {rowid} AS source_rowid, {key_str} FROM {source_tables['from']}))
+        WHERE source_rowid = (SELECT MIN({rowid}) FROM {source_tables['rows']}) OR {change_str};
+        """)
+    last_rowid = db_connection.execute(f'SELECT MAX({rowid}) FROM {source_tables["rows"]};').fetchone()[0]
+    runs = db_connection.execute(f"""
+    SELECT first_rowid, COALESCE(last_rowid, ?), is_first AND NOT EXISTS (SELECT 1 FROM temp.duplicate_trials d WHERE {match_str})
+    FROM temp.source_runs r ORDER BY first_rowid;
+    """, (last_rowid,)).fetchall()
+    num_repeated_runs = db_connection.execute(f'SELECT COUNT(*) FROM temp.source_runs r WHERE NOT is_first AND NOT EXISTS (SELECT 1 FROM temp.duplicate_trials d WHERE {match_str});').fetchone()[0]
+    db_connection.execute('DROP TABLE temp.source_runs;')
+
+    # Join the neighbouring runs, so that a source without duplicates is a single range
+    ranges = list()
+    for first_rowid, last_rowid, is_copied in runs:
+        if not is_copied:
+            continue
+        if ranges and ranges[-1][1] == first_rowid - 1:
+            ranges[-1] = (ranges[-1][0], last_rowid)
+        else:
+            ranges.append((first_rowid, last_rowid))
+    return ranges, num_repeated_runs
+
+def copy_rows(db_connection, table, source_tables, ranges, batch_size, desc):
+    """
+    Copies the given rowid ranges of a source table into the target in batches of
+    batch_size rowids, each in its own transaction, so that the journal stays small
+    and an interrupted merge keeps the batches that were committed.
+
+    Args:
+        db_connection (sqlite3.Connection): A connection with the source attached as 'source'.
+        table (str): The name of the target table.
+        source_tables (dict): The source description returned by get_source_tables.
+        ranges (list): The (first rowid, last rowid) ranges returned by get_copy_ranges.
+        batch_size (int): The number of source rowids per transaction.
+        desc (str): The label of the progress bar.
+
+    Returns:
+        None
+    """
+    columns = source_tables['columns']
+    query = f"""
+    INSERT INTO main."{table}" ({', '.join(f'"{name}"' for name in columns)})
+    SELECT {', '.join(expression for expression, column_type in columns.values())}
+    FROM {source_tables['from']}
+    WHERE {source_tables['rowid']} BETWEEN ? AND ?;
+    """
+
+    pbar = tqdm(total=sum(last_rowid - first_rowid + 1 for first_rowid, last_rowid in ranges), desc=desc, unit='rows', unit_scale=True)
+    batch = list()
+    batch_rows = 0
+    for first_rowid, last_rowid in ranges:
+        for batch_start in range(first_rowid, last_rowid + 1, batch_size):
+            batch_end = min(batch_start + batch_size - 1, last_rowid)
+            batch.append((batch_start, batch_end))
+            batch_rows += batch_end - batch_start + 1
+            if batch_rows >= batch_size:
+                with db_connection:
+                    db_connection.executemany(query, batch)
+                pbar.update(batch_rows)
+                batch, batch_rows = list(), 0
+    if batch:
+        with db_connection:
+            db_connection.executemany(query, batch)
+        pbar.update(batch_rows)
+    pbar.close()
+
+def merge_databases(target_file, source_files, batch_size = 500000):
+    """
+    Merges the 'ethovision_data' and 'tracking_quality' tables of any number of
+    databases into the wide 'ethovision_data' table of the target database.
+
+    The sources may be wide or normalized and may have different columns: the
+    columns are matched by name and those a source lacks are NULL for its rows.
+    A new target table takes the numeric type of a column if any source declares
+    it numeric, and TEXT values of older sources are stored as numbers in it.
+    Trials, keyed on (Arena_ID, Trial_ID, Subject_ID, Start_time), that are already
+    in the target or in an earlier source are skipped, and a trial appended to a
+    source more than once is copied once (see get_copy_ranges), so merging
+    overlapping campaigns or running the merge twice does not duplicate samples. The rows are
+    copied in bounded transactions with a progress bar; the subject indexes are
+    dropped during the copy and built once at the end, after which the day
+    numbers of the merged subjects are recomputed.
+
+    Args:
+        target_file (str): The path of the merged database, created if it does not exist.
+        source_files (list): The paths of the databases to merge, in order of precedence.
+        batch_size (int, optional): The number of source rows per transaction. Defaults to 500000.
 
     Returns:
         None
+
+    Raises:
+        FileNotFoundError: If a source does not exist. ATTACH would create an empty database there.
     """
-    # Connect to the first database
-    conn1 = sqlite3.connect(f'{filepath}habituation2023_ethovision_data.db')
-    c1 = conn1.cursor()
+    missing_files = [source_file for source_file in source_files if not os.path.exists(source_file)]
+    if missing_files:
+        raise FileNotFoundError(f'Source databases not found: {", ".join(missing_files)}')
+
+    db_connection = sqlite3.connect(target_file)
+    row = db_connection.execute("SELECT type FROM sqlite_master WHERE name = 'ethovision_data';").fetchone()
+    if row is not None and row[0] == 'view':
+        print(f"Error: {target_file} uses the normalized layout, merge into a new database instead")
+        db_connection.close()
+        return
+
+    start = time.perf_counter()
+    key_str = ', '.join(f'"{column}"' for column in TRIAL_KEY)
+    with db_connection:
+        for index_name in list(ETHOVISION_DATA_INDEXES) + OBSOLETE_INDEXES:
+            db_connection.execute(f'DROP INDEX IF EXISTS main.{index_name};')
+        db_connection.execute(f'CREATE TEMP TABLE merged_trials ({key_str});')
+        db_connection.execute(f'CREATE INDEX temp.merged_trials_key ON merged_trials ({key_str});')
+        if row is not None:
+            target_key_str = ', '.join(f'CAST("{column}" AS TEXT)' for column in TRIAL_KEY)
+            db_connection.execute(f'INSERT INTO temp.merged_trials SELECT DISTINCT {target_key_str} FROM main.ethovision_data;')
+
+    for table in ['ethovision_data', 'tracking_quality']:
+        columns = get_merged_columns(db_connection, source_files, table)
+        if columns:
+            reconcile_columns(db_connection, table, columns)
+
+    for source_file in source_files:
+        db_connection.execute('ATTACH DATABASE ? AS source;', (source_file,))
+        source_tables = get_source_tables(db_connection, 'ethovision_data')
+        if source_tables is None:
+            print(f"Skipping {source_file}: no 'ethovision_data' table")
+            db_connection.execute('DETACH DATABASE source;')
+            continue
 
-    # Create a new database and a cursor for it
-    conn_new = sqlite3.connect(f'{filepath}combined_ethovision_data.db')
-    c_new = conn_new.cursor()
+        num_duplicates = find_duplicate_trials(db_connection, source_tables)
+        if num_duplicates:
+            print(f'{source_file}: skipping {num_duplicates} trials that are already merged')
 
-    # Create a new table in the new database with the same structure as the 'ethovision_data' table
-    c1.execute("SELECT sql FROM sqlite_master WHERE name = 'ethovision_data'")
-    create_table_query = c1.fetchone()[0]
-    c_new.execute(create_table_query)
+        ranges, num_repeated_runs = get_copy_ranges(db_connection, source_tables)
+        if num_repeated_runs:
+            print(f'{source_file}: skipping {num_repeated_runs} repeated copies of trials within the source')
+        copy_rows(db_connection, 'ethovision_data', source_tables, ranges, batch_size, f'merging {source_file}')
 
-    # Attach the databases
-    c_new.execute(f"ATTACH DATABASE '{filepath}habituation2023_ethovision_data.db' AS db1")
-    c_new.execute(f"ATTACH DATABASE '{filepath}rehabituation2023_ethovision_data.db' AS db2")
-    c_new.execute(f"ATTACH DATABASE '{filepath}meth2023_ethovision_data.db' AS db3")
+        quality_tables = get_source_tables(db_connection, 'tracking_quality')
+        if quality_tables is not None:
+            ranges, num_repeated_runs = get_copy_ranges(db_connection, quality_tables)
+            copy_rows(db_connection, 'tracking_quality', quality_tables, ranges, batch_size, 'tracking quality')
 
-    # Copy the data from the tables in the other databases into the table in the new database
-    c_new.execute("INSERT INTO ethovision_data SELECT * FROM db1.ethovision_data")
-    c_new.execute("INSERT INTO ethovision_data SELECT * FROM db2.ethovision_data")
-    c_new.execute("INSERT INTO ethovision_data SELECT * FROM db3.ethovision_data")
+        with db_connection:
+            db_connection.execute('INSERT INTO temp.merged_trials SELECT * FROM temp.source_trials EXCEPT SELECT * FROM temp.duplicate_trials;')
+        db_connection.execute('DETACH DATABASE source;')
 
-    # Save (commit) the changes and close the connections
-    conn_new.commit()
-    conn1.close()
-    conn_new.close()
+    print('building indexes')
+    create_ethovision_indexes(db_connection)
+    update_day_numbers(db_connection)
+    db_connection.close()
+    print(f'merged {len(source_files)} databases into {target_file} in {time.perf_counter() - start:.1f} s')
 
-combine_databases('/home/bgeurten/ethoVision_database/')
+if __name__ == '__main__':
+    # python -m run_scripts.sql_merge_db combined.db first.db second.db ...
+    if len(sys.argv) > 2:
+        merge_databases(sys.argv[1], sys.argv[2:])
+    else:
+        filepath = '/home/bgeurten/ethoVision_database/'
+        merge_databases(f'{filepath}combined_ethovision_data.db',
+                        [f'{filepath}habituation2023_ethovision_data.db',
+                         f'{filepath}rehabituation2023_ethovision_data.db',
+                         f'{filepath}meth2023_ethovision_data.db'])
@@ -0,0 +1,29 @@
+from fish_data_base.EthoVisionSQLdataBase import EthoVisionSQLdataBase
+from fish_data_base.EthoVisionParquetDataBase import EthoVisionParquetDataBase
+from tqdm import tqdm
+
+def convert_database(sqlite_name, parquet_name):
+    """
+    Copies an EthoVision SQLite database into a partitioned Parquet dataset, see
+    EthoVisionParquetDataBase. The database is read in one ordered pass and left
+    unchanged; converting again replaces the trials already in the dataset.
+
+    Args:
+        sqlite_name (str): The path of the SQLite database.
+        parquet_name (str): The root directory of the Parquet dataset.
+
+    Returns:
+        None
+    """
+    ev_db = EthoVisionSQLdataBase(sqlite_name)
+    parquet_db = EthoVisionParquetDataBase(parquet_name)
+    num_trials = 0
+    for tank_number, id_val, subject_df in tqdm(ev_db.iter_subjects(), desc='converting subjects'):
+        num_trials += parquet_db.write_data(subject_df)
+    ev_db.close_connection()
+    print(f'Wrote {num_trials} trials to {parquet_name}')
+
+if __name__ == '__main__':
+    tag = 'combined'
+    parent_directory = '/home/bgeurten/ethoVision_database/'
+    convert_database(f'{parent_directory}{tag}_ethovision_data.db', f'{parent_directory}{tag}_ethovision_data.parquet')
@@ -31,9 +31,22 @@ class EthovisionDataProcessor:
     def add_day_number(self):
         """
         Adds a new 'Day_number' column to the subject DataFrame based on the 'Start_time' column.
-        The 'Day_number' column starts at 0 for the earliest date and increments by one for each
+        The 'Day_number' column starts at 1 for the earliest date and increments by one for each
         unique date in the 'Start_time' column.
+
+        A 'Day_number' column computed at ingest is used as it is. Otherwise the integer
+        'Start_time_epoch' column is used if present, and the 'Start_time' strings are
+        only parsed for data ingested without it.
         """
+        if 'Day_number' in self.subject_df.columns and self.subject_df['Day_number'].notna().all():
+            return
+
+        if 'Start_time_epoch' in self.subject_df.columns and self.subject_df['Start_time_epoch'].notna().all():
+            # Whole days since the epoch, ranked from 1
+            days = self.subject_df['Start_time_epoch'].to_numpy(dtype=np.int64) // 86400
+            self.subject_df['Day_number'] = np.searchsorted(np.unique(days), days) + 1
+            return
+
         # Convert 'Start_time' column to datetime format
         self.subject_df['Start_time'] = pd.to_datetime(self.subject_df['Start_time'], format='%m/%d/%Y %H:%M:%S.%f')
 